@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+from .config import get_settings
+from .metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# (method or None for any, path prefix, class); first match wins. Routes not
+# listed (metrics, readiness, docs) are never queued or shed. Batch requests
+# have a class of their own; each of their items also takes a slot of the
+# item's class (see ``admitted``), so a batch cannot run more pipelines than
+# single requests could.
+ROUTE_CLASSES = [
+    (None, "/token", "auth"),
+    (None, "/users/me", "auth"),
+    ("GET", "/process_audio/jobs/", "reads"),
+    ("POST", "/process_audio/batch", "batch"),
+    ("POST", "/combine_narrative/batch", "batch"),
+    (None, "/process_audio/", "audio"),
+    (None, "/combine_narrative/", "narrative"),
+    (None, "/history/", "reads"),
+    (None, "/search/", "reads"),
+    (None, "/export/", "reads"),
+]
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    for route_method, prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix) and (route_method is None or route_method == method):
+            return name
+    return None
+
+
+class Shed(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteLimiter:
+    """In-flight slots and a bounded wait queue for one class of routes.
+
+    Each class owns its slots, so a backlog of slow audio requests cannot
+    take capacity from token or narrative traffic. A request that finds
+    ``queue_size`` others already waiting, or waits longer than
+    ADMISSION_QUEUE_TIMEOUT, is shed.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.slots = asyncio.Semaphore(concurrency)
+        self.queued = 0
+        self.latency = 1.0  # Moving average of request duration, for Retry-After estimates
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.latency * (self.queued + 1) / self.concurrency))
+
+    async def acquire(self):
+        if not self.slots.locked():
+            # A free slot is taken without suspending, so the check above stays true
+            await self.slots.acquire()
+        elif self.queued >= self.queue_size:
+            raise Shed("queue_full", self.retry_after())
+        else:
+            self.queued += 1
+            ADMISSION_QUEUE_DEPTH.labels(self.name).inc()
+            try:
+                await asyncio.wait_for(self.slots.acquire(), settings.ADMISSION_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise Shed("queue_timeout", self.retry_after())
+            finally:
+                self.queued -= 1
+                ADMISSION_QUEUE_DEPTH.labels(self.name).dec()
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+
+    def release(self, duration: float):
+        self.latency = 0.8 * self.latency + 0.2 * duration
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        self.slots.release()
+
+
+# Shared by the middleware and ``admitted``; created on first use so the semaphores bind to the running loop
+_limiters: Dict[str, RouteLimiter] = {}
+
+
+def limiter_for(name: str) -> Optional[RouteLimiter]:
+    if name not in _limiters:
+        concurrency = settings.ADMISSION_CONCURRENCY.get(name)
+        if not concurrency:
+            return None
+        _limiters[name] = RouteLimiter(name, concurrency, settings.ADMISSION_QUEUE_SIZE.get(name, 0))
+    return _limiters[name]
+
+
+@asynccontextmanager
+async def admitted(name: str):
+    """Hold a slot of route class ``name`` around work admitted inside a request, e.g. one batch item.
+
+    Waits and sheds like a request of that class; a shed raises 503.
+    """
+    limiter = limiter_for(name)
+    if limiter is None:
+        yield
+        return
+    try:
+        await limiter.acquire()
+    except Shed as e:
+        ADMISSION_SHED.labels(name, e.reason).inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        limiter.release(time.perf_counter() - started)
+
+
+class AdmissionMiddleware:
+    """Admits requests per route class and answers 503 with Retry-After when a class is over capacity.
+
+    Requests wait before their body is read, so a queued upload holds no
+    memory. The slot is held until the response is fully sent, streamed
+    responses included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = route_class(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        limiter = limiter_for(name) if name else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except Shed as e:
+            ADMISSION_SHED.labels(name, e.reason).inc()
+            logger.warning(f"Shed {scope['method']} {scope['path']} ({name}: {e.reason}, {limiter.queued} waiting)")
+            response = JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"detail": "Server is busy, try again later"},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - started)
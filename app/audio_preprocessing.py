@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import re
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+_SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+_PROGRESS_TIME = re.compile(r"time=(\d+):(\d+):([\d.]+)")
+
+# Silences this close to either end of the recording count as leading/trailing
+_EDGE_TOLERANCE = 0.05
+
+
+class PreparedAudio:
+    """Downsampled, silence-trimmed audio split into upload-sized segments"""
+
+    def __init__(self, workdir: tempfile.TemporaryDirectory, segments: List[Path], duration: float):
+        self._workdir = workdir
+        self.segments = segments
+        self.duration = duration
+
+    @property
+    def upload_bytes(self) -> int:
+        return sum(segment.stat().st_size for segment in self.segments)
+
+    def cleanup(self):
+        self._workdir.cleanup()
+
+
+async def _run_ffmpeg(args: List[str], stdin: Optional[int] = None) -> str:
+    """Run ffmpeg and return its stderr; raises RuntimeError on failure"""
+    process = await asyncio.create_subprocess_exec(
+        settings.FFMPEG_PATH, "-hide_banner", *args,
+        stdin=stdin if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    output = stderr.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {output[-500:]}")
+    return output
+
+
+def _parse_silences(output: str) -> List[Tuple[float, Optional[float]]]:
+    """(start, end) silence intervals from silencedetect output; end is None if it runs to EOF"""
+    silences: List[Tuple[float, Optional[float]]] = []
+    for line in output.splitlines():
+        start = _SILENCE_START.search(line)
+        if start:
+            silences.append((max(0.0, float(start.group(1))), None))
+            continue
+        end = _SILENCE_END.search(line)
+        if end and silences and silences[-1][1] is None:
+            silences[-1] = (silences[-1][0], float(end.group(1)))
+    return silences
+
+
+def _parse_duration(output: str) -> float:
+    matches = _PROGRESS_TIME.findall(output)
+    if not matches:
+        return 0.0
+    hours, minutes, seconds = matches[-1]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, Optional[float]]], segment_seconds: float) -> List[Tuple[float, float]]:
+    """Trim leading/trailing silence and cut the rest into segments of at most ``segment_seconds``.
+
+    Cuts are placed in the middle of the last silence before each limit;
+    a segment without any silence is cut hard at the limit.
+    """
+    start, end = 0.0, duration
+    if silences and silences[0][0] <= _EDGE_TOLERANCE and silences[0][1] is not None:
+        start = silences[0][1]
+    if silences and (silences[-1][1] is None or silences[-1][1] >= duration - _EDGE_TOLERANCE):
+        end = silences[-1][0]
+    if end - start <= 0:
+        return []
+
+    cuts = [(s + e) / 2 for s, e in silences if e is not None and start < s and e < end]
+    segments = []
+    segment_start = start
+    while end - segment_start > segment_seconds:
+        limit = segment_start + segment_seconds
+        candidates = [cut for cut in cuts if segment_start < cut <= limit]
+        cut = candidates[-1] if candidates else limit
+        segments.append((segment_start, cut))
+        segment_start = cut
+    segments.append((segment_start, end))
+    return segments
+
+
+async def prepare_audio(source: Union[str, int]) -> Optional[PreparedAudio]:
+    """Downsample ``source`` (a path, or a file descriptor read from its current offset) for Whisper.
+
+    One ffmpeg pass converts to mono speech bitrate while detecting silence;
+    leading and trailing silence is then trimmed and long recordings are
+    split on silence into AUDIO_SEGMENT_SECONDS segments. Returns None when
+    preprocessing is disabled, ffmpeg is unavailable or fails, or it leaves
+    nothing to upload (no duration reported, or all silence), in which case
+    the original file should be uploaded as-is.
+    """
+    if not settings.AUDIO_PREPROCESS:
+        return None
+
+    workdir = tempfile.TemporaryDirectory(prefix="jarvic-audio-")
+    try:
+        normalized = Path(workdir.name) / "normalized.mp3"
+        input_arg = source if isinstance(source, str) else "pipe:0"
+        output = await _run_ffmpeg([
+            "-i", input_arg,
+            "-vn",
+            "-af", f"silencedetect=noise={settings.AUDIO_SILENCE_THRESHOLD_DB}dB:d={settings.AUDIO_MIN_SILENCE_SECONDS}",
+            "-ac", "1",
+            "-ar", str(settings.AUDIO_SAMPLE_RATE),
+            "-b:a", settings.AUDIO_BITRATE,
+            "-f", "mp3", "-y", str(normalized),
+        ], stdin=source if isinstance(source, int) else None)
+
+        duration = _parse_duration(output)
+        segments = plan_segments(duration, _parse_silences(output), settings.AUDIO_SEGMENT_SECONDS)
+        if duration <= 0 or not segments:
+            # Unparsed duration or silence throughout; Whisper gets the original rather than nothing
+            workdir.cleanup()
+            logger.warning(f"Audio preprocessing found no speech in {duration:.1f}s of audio, uploading original audio")
+            return None
+
+        if len(segments) == 1 and segments[0] == (0.0, duration):
+            paths = [normalized]
+        else:
+            paths = []
+            for index, (start, end) in enumerate(segments):
+                path = Path(workdir.name) / f"segment-{index:03d}.mp3"
+                await _run_ffmpeg([
+                    "-v", "error",
+                    "-ss", f"{start:.3f}", "-to", f"{end:.3f}",
+                    "-i", str(normalized),
+                    "-c", "copy", "-y", str(path),
+                ])
+                paths.append(path)
+
+        prepared = PreparedAudio(workdir, paths, duration)
+        logger.info(f"Preprocessed {duration:.1f}s of audio into {len(paths)} segment(s), {prepared.upload_bytes} upload bytes")
+        return prepared
+
+    except (OSError, RuntimeError) as e:
+        workdir.cleanup()
+        logger.warning(f"Audio preprocessing unavailable, uploading original audio: {str(e)}")
+        return None
+
+
+async def transcribe_segments(prepared: PreparedAudio, transcribe_file: Callable[[Path], Awaitable[str]]) -> str:
+    """Transcribe every segment with at most TRANSCRIPTION_CONCURRENCY in flight and join them in order"""
+    semaphore = asyncio.Semaphore(settings.TRANSCRIPTION_CONCURRENCY)
+
+    async def transcribe(path: Path) -> str:
+        async with semaphore:
+            return await transcribe_file(path)
+
+    texts = await asyncio.gather(*(transcribe(path) for path in prepared.segments))
+    return " ".join(text.strip() for text in texts if text and text.strip())
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+from .config import get_settings
+from .downloads import DownloadedAudio, download_audio, filename_for, receive_audio
+from .metrics import AUDIO_STORE_BYTES, AUDIO_STORE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Temp files older than this were left by a crashed worker
+_STALE_TMP_SECONDS = 3600
+
+
+class AudioStore:
+    """Downloaded audio kept on disk, addressed by content hash.
+
+    ``objects/<sha256>`` holds each distinct recording once, however many
+    URLs serve it; ``urls/<sha256 of url>.json`` maps a URL to its object
+    and the ETag/Last-Modified it was fetched with, so a repeat request is
+    revalidated with a conditional GET and a 304 skips the download.
+    Objects are written to ``tmp/`` and renamed into place, so readers
+    never see a partial file. Once the store grows past ``max_bytes`` the
+    least recently used objects are removed; the size is tracked per
+    worker, so with several workers the limit is approximate.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._objects = self.root / "objects"
+        self._urls = self.root / "urls"
+        self._tmp = self.root / "tmp"
+        self._size = 0
+        self._usable: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    # Everything below blocks and runs in a threadpool, except ``fetch``
+
+    def usable(self) -> bool:
+        """Create the store layout on first use; False (store bypassed) if the directory is not writable"""
+        with self._lock:
+            if self._usable is None:
+                try:
+                    for directory in (self._objects, self._urls, self._tmp):
+                        directory.mkdir(parents=True, exist_ok=True)
+                    self._remove_stale_tmp()
+                    self._size = sum(entry.stat().st_size for entry in self._objects.iterdir())
+                    AUDIO_STORE_BYTES.set(self._size)
+                    self._usable = True
+                except OSError as e:
+                    logger.warning(f"Audio store at {self.root} is unavailable, downloading per request: {str(e)}")
+                    self._usable = False
+            return self._usable
+
+    def _remove_stale_tmp(self):
+        cutoff = time.time() - _STALE_TMP_SECONDS
+        for entry in self._tmp.iterdir():
+            if entry.stat().st_mtime < cutoff:
+                entry.unlink(missing_ok=True)
+
+    def _url_path(self, url: str) -> Path:
+        return self._urls / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """Stored metadata for ``url``, or None if it was never fetched or its object was evicted"""
+        try:
+            with open(self._url_path(url), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not (self._objects / meta["sha256"]).exists():
+            return None
+        return meta
+
+    def open(self, url: str, meta: dict) -> DownloadedAudio:
+        """Open a stored object for streamed reads and mark it recently used"""
+        path = self._objects / meta["sha256"]
+        file = open(path, "rb")
+        os.utime(path)
+        return DownloadedAudio(file, filename_for(url), meta["size"], meta["sha256"])
+
+    def new_tmp(self):
+        return NamedTemporaryFile(dir=self._tmp, delete=False)
+
+    def commit(self, tmp, url: str, size: int, sha256: str, etag: Optional[str], last_modified: Optional[str]) -> dict:
+        """Move a finished download into ``objects/`` and record ``url`` against it"""
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp.close()
+        path = self._objects / sha256
+        if path.exists():
+            # Same content as a stored object, e.g. served from another URL
+            os.unlink(tmp.name)
+            os.utime(path)
+        else:
+            os.replace(tmp.name, path)
+            with self._lock:
+                self._size += size
+                AUDIO_STORE_BYTES.set(self._size)
+
+        meta = {"url": url, "sha256": sha256, "size": size, "etag": etag, "last_modified": last_modified}
+        # A temp file of its own: concurrent downloads of the same URL commit at the same time
+        with NamedTemporaryFile("w", encoding="utf-8", dir=self._tmp, suffix=".json", delete=False) as f:
+            json.dump(meta, f)
+        os.replace(f.name, self._url_path(url))
+
+        if self._size > self.max_bytes:
+            self.evict()
+        return meta
+
+    def discard(self, tmp):
+        tmp.close()
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used objects until the store is at 90% of ``max_bytes``"""
+        with self._lock:
+            objects = []
+            for entry in self._objects.iterdir():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, entry))
+            objects.sort()
+            size = sum(item[1] for item in objects)
+            target = self.max_bytes * 0.9
+            removed = 0
+            for _, object_size, entry in objects:
+                if size <= target:
+                    break
+                # Readers that already opened the file keep it until they close it
+                entry.unlink(missing_ok=True)
+                size -= object_size
+                removed += 1
+            self._size = size
+            AUDIO_STORE_BYTES.set(size)
+
+            if removed:
+                for entry in self._urls.glob("*.json"):
+                    try:
+                        with open(entry, encoding="utf-8") as f:
+                            sha256 = json.load(f)["sha256"]
+                    except (OSError, ValueError, KeyError):
+                        continue
+                    if not (self._objects / sha256).exists():
+                        entry.unlink(missing_ok=True)
+                logger.info(f"Evicted {removed} audio files from the store, {size} bytes left")
+
+    async def fetch(self, http_client: httpx.AsyncClient, url: str, retry: bool = True) -> DownloadedAudio:
+        """Stored copy of ``url`` if the server confirms it is unchanged, else download it into the store"""
+        meta = await run_in_threadpool(self.lookup, url)
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        async with http_client.stream("GET", url, headers=headers) as response:
+            if headers and response.status_code == httpx.codes.NOT_MODIFIED:
+                try:
+                    audio = await run_in_threadpool(self.open, url, meta)
+                except FileNotFoundError:
+                    audio = None
+                if audio is not None:
+                    AUDIO_STORE_REQUESTS.labels("not_modified").inc()
+                    logger.info(f"Audio unchanged since it was stored ({meta['size']} bytes), skipping download")
+                    return audio
+            else:
+                response.raise_for_status()
+
+                tmp = await run_in_threadpool(self.new_tmp)
+                try:
+                    size, sha256 = await receive_audio(response, tmp)
+                    meta = await run_in_threadpool(
+                        self.commit, tmp, url, size, sha256,
+                        response.headers.get("ETag"), response.headers.get("Last-Modified")
+                    )
+                except BaseException:
+                    await run_in_threadpool(self.discard, tmp)
+                    raise
+                AUDIO_STORE_REQUESTS.labels("downloaded").inc()
+                try:
+                    return await run_in_threadpool(self.open, url, meta)
+                except FileNotFoundError:
+                    pass
+
+        # Evicted between the lookup and the 304, or between the commit and the open
+        if retry:
+            # Without metadata the retry downloads
+            return await self.fetch(http_client, url, retry=False)
+        # Evicted again, e.g. an object too large for the store; download around it this time
+        logger.warning(f"Audio from {url} was evicted from the store before it could be read, downloading per request")
+        return await download_audio(http_client, url)
+
+
+audio_store = AudioStore(settings.AUDIO_STORE_DIR, settings.AUDIO_STORE_MAX_BYTES)
+
+
+async def fetch_audio(http_client: httpx.AsyncClient, url: str) -> DownloadedAudio:
+    """Audio behind ``url`` through the on-disk store, or a per-request download if the store is off"""
+    if settings.AUDIO_STORE_DIR and await run_in_threadpool(audio_store.usable):
+        return await audio_store.fetch(http_client, url)
+    return await download_audio(http_client, url)
@@ -1,11 +1,20 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from ..config import get_settings
+from ..database import get_user_record, insert_missing_users
 from .models import TokenData, User, UserInDB
 
+settings = get_settings()
+
 # JWT Configuration
 SECRET_KEY = "your-secret-key-here"  # Change this to a secure secret key
 ALGORITHM = "HS256" 
@@ -15,11 +24,12 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Fake user database - Replace with your actual database
+# Default accounts seeded into the users table on startup. The hash is
+# precomputed ("testpass") so importing this module never runs bcrypt.
 fake_users_db = {
     "testuser": {
         "username": "testuser",
-        "hashed_password": pwd_context.hash("testpass"),
+        "hashed_password": "$2b$12$jcK0S.slzfD5HRbeadCXOeV0RFGwciRMFTKoqRWUHoZC6TnX5Ycl6",
         "disabled": False,
     }
 }
@@ -38,8 +48,52 @@ def get_user(db, username: str) -> Optional[UserInDB]:
         return UserInDB(**user_dict)
     return None
 
-def authenticate_user(db, username: str, password: str) -> Union[bool, UserInDB]:
-    user = get_user(db, username)
+class UserStore:
+    """Users from the users table, cached for USER_CACHE_TTL seconds"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._users: Dict[str, Tuple[float, Optional[UserInDB]]] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, username: str) -> Tuple[bool, Optional[UserInDB]]:
+        """(found, user) from the cache only; never touches the database"""
+        with self._lock:
+            entry = self._users.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def get_user(self, username: str) -> Optional[UserInDB]:
+        """Cached lookup, falling back to the users table (blocking)"""
+        found, user = self.cached(username)
+        if found:
+            return user
+        record = get_user_record(username)
+        user = UserInDB(**record) if record else None
+        with self._lock:
+            self._users[username] = (time.monotonic() + self.ttl, user)
+        return user
+
+    async def aget_user(self, username: str) -> Optional[UserInDB]:
+        found, user = self.cached(username)
+        if found:
+            return user
+        return await run_in_threadpool(self.get_user, username)
+
+
+user_store = UserStore(settings.USER_CACHE_TTL)
+
+def seed_default_users():
+    """Create the fake_users_db accounts in the users table if missing (blocking)"""
+    insert_missing_users([
+        (user["username"], user["hashed_password"], user["disabled"])
+        for user in fake_users_db.values()
+    ])
+
+def authenticate_user(username: str, password: str) -> Union[bool, UserInDB]:
+    """Look up and bcrypt-verify a user; blocking, so call it from a threadpool"""
+    user = user_store.get_user(username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -47,6 +101,46 @@ def authenticate_user(db, username: str, password: str) -> Union[bool, UserInDB]
     return user
 
 
+class TokenCache:
+    """Bounded LRU of already validated JWTs, keyed by token digest.
+
+    Entries expire with the token's own ``exp`` claim, so a cached token is
+    never accepted past the point jwt.decode would reject it.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+            return entry[1]
+
+    def put(self, token: str, username: str, expires_at: float):
+        key = self._key(token)
+        with self._lock:
+            self._tokens[key] = (expires_at, username)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+
+
 # def get_user(db, username: str) -> UserInDB | None:
 #     if username in db:
 #         user_dict = db[username]
@@ -77,15 +171,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
+        username = token_data.username
+        if payload.get("exp") is not None:
+            token_cache.put(token, username, float(payload["exp"]))
+    user = await user_store.aget_user(username)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from mysql.connector import Error
+
+from .admission import admitted
+from .config import get_settings
+from .models import (
+    AudioBatchItemResult,
+    AudioBatchOutput,
+    AudioProcessingInput,
+    NarrativeBatchItemResult,
+    NarrativeBatchOutput,
+    NarrativeInput
+)
+from .pipeline import audio_record, entry_hashes, narrative_record, run_audio_pipeline, run_narrative_pipeline
+from .write_behind import AUDIO, NARRATIVE, persist_records
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+Outcome = Tuple[int, Optional[object], Optional[str]]
+
+
+async def _fan_out(items: list, run_one: Callable[[object], Awaitable[object]], route_class: str) -> List[Outcome]:
+    """Run ``run_one`` over ``items`` with at most BATCH_CONCURRENCY in flight.
+
+    Each item is admitted like a single request of ``route_class``, so it
+    waits for a slot of that class and fails with "Server is busy" when
+    shed. Returns ``(index, output, error)`` per item; one item failing
+    never affects the others.
+    """
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+    async def run(index: int, item) -> Outcome:
+        async with semaphore:
+            try:
+                async with admitted(route_class):
+                    return index, await run_one(item), None
+            except HTTPException as e:
+                return index, None, str(e.detail)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed", exc_info=True)
+                return index, None, str(e)
+
+    return await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+
+
+async def _persist(table: str, records: List[tuple]) -> Optional[str]:
+    """Write every successful row of a batch in one multi-row insert; returns an error message on failure"""
+    if not records:
+        return None
+    try:
+        await persist_records(table, records)
+        return None
+    except (Error, HTTPException) as e:
+        logger.error(f"Batch database error: {str(e)}", exc_info=True)
+        return "Database error"
+
+
+async def run_audio_batch(inputs: List[AudioProcessingInput]) -> AudioBatchOutput:
+    outcomes = await _fan_out(inputs, lambda item: run_audio_pipeline(item, persist=False), "audio")
+    records = [audio_record(inputs[index], output) for index, output, _ in outcomes if output is not None]
+    db_error = await _persist(AUDIO, records)
+
+    results = []
+    for index, output, error in outcomes:
+        if output is not None and db_error is None:
+            results.append(AudioBatchItemResult(index=index, status="completed", result=output))
+        else:
+            results.append(AudioBatchItemResult(index=index, status="failed", error=error or db_error))
+    logger.info(f"Audio batch finished: {len(records)} of {len(inputs)} items succeeded")
+    return AudioBatchOutput(results=results)
+
+
+async def run_narrative_batch(inputs: List[NarrativeInput]) -> NarrativeBatchOutput:
+    outcomes = await _fan_out(inputs, lambda item: run_narrative_pipeline(item, persist=False), "narrative")
+    records = [
+        narrative_record(output, entry_hashes(inputs[index].entries))
+        for index, output, _ in outcomes if output is not None
+    ]
+    db_error = await _persist(NARRATIVE, records)
+
+    results = []
+    for index, output, error in outcomes:
+        if output is not None and db_error is None:
+            results.append(NarrativeBatchItemResult(index=index, status="completed", result=output))
+        else:
+            results.append(NarrativeBatchItemResult(index=index, status="failed", error=error or db_error))
+    logger.info(f"Narrative batch finished: {len(records)} of {len(inputs)} items succeeded")
+    return NarrativeBatchOutput(results=results)
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .metrics import COMPLETION_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class CompletionCache:
+    """Recent chat completions keyed by a hash of model and prompt.
+
+    Identical requests within ``ttl`` seconds reuse the stored text, and
+    concurrent identical requests share a single in-flight completion
+    (single-flight). Entries are evicted least recently used first once
+    there are more than ``max_entries`` or their text exceeds ``max_bytes``.
+    State is per worker process.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key(model: str, messages: List[dict]) -> str:
+        payload = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key: str) -> Optional[str]:
+        text = self._lookup(key)
+        if text is None:
+            COMPLETION_CACHE_REQUESTS.labels("miss").inc()
+        else:
+            COMPLETION_CACHE_REQUESTS.labels("hit").inc()
+            logger.info(f"Completion cache hit for {key[:12]}")
+        return text
+
+    def put(self, key: str, text: str):
+        size = len(text.encode("utf-8")) if text else 0
+        if not text or self.ttl <= 0 or size > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[1].encode("utf-8"))
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[str]]) -> str:
+        """Cached text for ``key``, joining an identical in-flight request or running ``create``"""
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                text = self.get(key)
+                if text is not None:
+                    return text
+                break
+            COMPLETION_CACHE_REQUESTS.labels("coalesced").inc()
+            logger.info(f"Joining in-flight completion {key[:12]}")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The request we joined was cancelled, not us: run it ourselves
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            text = await create()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved, so an error nobody joined is not logged again
+            raise
+        finally:
+            del self._in_flight[key]
+
+        self.put(key, text)
+        future.set_result(text)
+        return text
+
+
+completion_cache = CompletionCache(
+    settings.COMPLETION_CACHE_SIZE,
+    settings.COMPLETION_CACHE_MAX_BYTES,
+    settings.COMPLETION_CACHE_TTL,
+)
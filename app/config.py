@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List
 
 class Settings(BaseSettings):
     # Database settings
@@ -9,9 +10,116 @@ class Settings(BaseSettings):
     DB_DATABASE: str
     DB_USERNAME: str
     DB_PASSWORD: str
+
+    # Database connection pool settings
+    DB_POOL_SIZE: int = 10  # Maximum connections held open per worker
+    DB_POOL_TIMEOUT: float = 5.0  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # Seconds before a connection is closed and replaced
+    DB_POOL_PRE_PING: bool = True  # Ping idle connections before handing them out
+    DB_MIGRATION_LOCK_TIMEOUT: int = 60  # Seconds a worker waits while another applies migrations
+
+    # Startup and readiness settings
+    STARTUP_RETRY_MAX_DELAY: float = 30.0  # Backoff cap between failed startup attempts
+    READINESS_DB_TIMEOUT: float = 2.0  # Seconds /ready waits for the database round trip
     
     # OpenAI settings
     OPENAI_API_KEY: str
+
+    # OpenAI scheduling settings; JSON objects keyed by model name, sized to the account's limits
+    OPENAI_MODEL_CONCURRENCY: Dict[str, int] = {"whisper-1": 8, "gpt-4o-mini": 32}  # Ceiling of the adaptive concurrency limit
+    OPENAI_DEFAULT_CONCURRENCY: int = 16  # For models not listed above
+    OPENAI_MIN_CONCURRENCY: int = 1  # Floor the limit is never halved below on 429s and timeouts
+    OPENAI_MODEL_RPM: Dict[str, int] = {"whisper-1": 500, "gpt-4o-mini": 5000}  # Requests per minute
+    OPENAI_MODEL_TPM: Dict[str, int] = {"gpt-4o-mini": 2000000}  # Prompt tokens per minute
+    OPENAI_QUEUE_TIMEOUT: float = 30.0  # Seconds a call may wait for a slot before failing with 503
+    OPENAI_MAX_RETRIES: int = 4
+    OPENAI_RETRY_BASE_DELAY: float = 0.5  # Seconds; doubled per attempt with full jitter
+    OPENAI_RETRY_MAX_DELAY: float = 20.0
+    OPENAI_CIRCUIT_FAILURES: int = 5  # Consecutive transient failures that open the circuit
+    OPENAI_CIRCUIT_RESET: float = 30.0  # Seconds the circuit stays open before a probe call
+
+    # Audio download settings
+    AUDIO_MAX_BYTES: int = 200 * 1024 * 1024  # Download cutoff; preprocessing keeps uploads under Whisper's 25 MB limit
+    AUDIO_SPOOL_MAX_SIZE: int = 1024 * 1024  # Bytes kept in memory before spilling to disk
+    AUDIO_DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+
+    # Audio store settings
+    AUDIO_STORE_DIR: str = "/app/audio_files"  # Downloads kept by content hash and revalidated by ETag; empty disables
+    AUDIO_STORE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024  # Least recently used files are evicted beyond this
+
+    # Audio preprocessing settings (requires ffmpeg)
+    AUDIO_PREPROCESS: bool = True
+    FFMPEG_PATH: str = "ffmpeg"
+    AUDIO_SAMPLE_RATE: int = 16000
+    AUDIO_BITRATE: str = "32k"  # Mono speech bitrate for uploads
+    AUDIO_SILENCE_THRESHOLD_DB: int = -40
+    AUDIO_MIN_SILENCE_SECONDS: float = 0.5
+    AUDIO_SEGMENT_SECONDS: int = 600  # Longer recordings are split on silence into segments of at most this length
+    TRANSCRIPTION_CONCURRENCY: int = 4  # Segments of one recording transcribed at the same time
+
+    # Transcript cache settings
+    TRANSCRIPT_CACHE_SIZE: int = 1024  # In-process LRU entries in front of transcription_cache
+
+    # Prompt budget settings
+    PROMPT_INPUT_TOKEN_BUDGET: int = 12000  # Tokens of entries/transcript per prompt before hierarchical summarization
+    PROMPT_CHUNK_TOKENS: int = 4000  # Chunk size when condensing an over-budget input
+    PROMPT_MAX_CONDENSE_ROUNDS: int = 3
+    PROMPT_DEDUP_SIMILARITY: float = 0.9  # Word-trigram Jaccard similarity at which entries with the same numbers and negations count as duplicates
+
+    # Completion cache settings (summaries and narratives)
+    COMPLETION_CACHE_TTL: float = 300.0  # Seconds an identical prompt reuses the stored completion; 0 only coalesces
+    COMPLETION_CACHE_SIZE: int = 2048  # Entries per worker
+    COMPLETION_CACHE_MAX_BYTES: int = 32 * 1024 * 1024  # Completion text held per worker
+
+    # Admission control settings; JSON objects keyed by route class (audio, narrative, auth, reads)
+    ADMISSION_CONCURRENCY: Dict[str, int] = {"audio": 32, "narrative": 64, "auth": 32, "reads": 32, "batch": 4}  # Requests handled at once; 0 or missing disables. Batch items also take audio/narrative slots
+    ADMISSION_QUEUE_SIZE: Dict[str, int] = {"audio": 64, "narrative": 128, "auth": 128, "reads": 64, "batch": 8}  # Requests allowed to wait beyond that
+    ADMISSION_QUEUE_TIMEOUT: float = 5.0  # Seconds a request may wait for a slot before failing with 503
+
+    # Background job settings
+    JOB_WORKERS: int = 4  # Concurrent audio jobs per API worker
+    JOB_LEASE_SECONDS: int = 60  # A running job whose lease is not renewed for this long is requeued
+
+    # Logging settings
+    LOG_QUEUE: bool = True  # Write log records from a background thread
+    LOG_FORMAT: str = "json"  # "json" or "text"
+    LOG_SAMPLE_RATE: float = 1.0  # Fraction of requests whose audio pipeline INFO lines are kept
+
+    # Authentication cache settings
+    USER_CACHE_TTL: int = 60  # Seconds a resolved user is reused before re-reading the users table
+    TOKEN_CACHE_SIZE: int = 10000  # Validated JWTs remembered per worker
+
+    # Batch endpoint settings
+    BATCH_CONCURRENCY: int = 4  # Items of one batch processed at the same time
+    BATCH_MAX_ITEMS: int = 100
+
+    # History API settings
+    HISTORY_PAGE_SIZE: int = 50
+    HISTORY_MAX_PAGE_SIZE: int = 200
+
+    # Search settings
+    SEARCH_PAGE_SIZE: int = 20
+    SEARCH_MAX_PAGE_SIZE: int = 100
+    SEARCH_MAX_RESULTS: int = 1000  # Deepest result reachable by paging; refine the query beyond that
+    SEARCH_SNIPPET_CHARS: int = 240
+
+    # Export settings
+    EXPORT_ADMINS: List[str] = []  # Users who may bulk-export every user's records; empty disables /export
+    EXPORT_FETCH_SIZE: int = 500  # Rows read from the server-side cursor per batch
+    EXPORT_GZIP_LEVEL: int = 6
+    EXPORT_NET_WRITE_TIMEOUT: int = 600  # Seconds MySQL waits on a slow export client before aborting
+
+    # Profiling settings
+    PROFILING_ADMINS: List[str] = []  # Users who may profile a request with X-Profile: 1 or ?profile=1; empty disables
+    PROFILE_DIR: str = "profiles"
+    PROFILE_SAMPLE_INTERVAL: float = 0.005  # Seconds between stack samples of the event loop thread
+    PROFILE_KEEP: int = 200  # Newest profiles kept in PROFILE_DIR
+
+    # Write-behind persistence settings
+    WRITE_BEHIND: bool = False  # Buffer processing records and write them in batches off the response path
+    WRITE_BEHIND_BATCH_SIZE: int = 200  # Rows per flush; reaching it triggers a flush early
+    WRITE_BEHIND_FLUSH_INTERVAL: float = 1.0  # Seconds between flushes
+    WRITE_BEHIND_SPILL_DIR: str = "spill"  # Buffered rows are fsynced here until written; use a persistent volume
     
     class Config:
         env_file = ".env"
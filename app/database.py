@@ -1,7 +1,14 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
 import mysql.connector
 from mysql.connector import Error
 from fastapi import HTTPException
 from .config import get_settings
+from .metrics import DB_POOL_WAIT
 
 settings = get_settings()
 
@@ -22,51 +29,584 @@ def get_db_connection():
         print(f"Error connecting to MySQL: {e}")
         raise HTTPException(status_code=500, detail="Database connection error")
 
-def init_db():
-    """Initialize database tables if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+
+class ConnectionPool:
+    """Bounded pool of MySQL connections.
+
+    At most ``size`` connections are checked out at once; callers wait up to
+    ``timeout`` seconds for a free slot. Idle connections are pinged before
+    reuse and closed once they are older than ``recycle`` seconds.
+    """
+
+    def __init__(self, size: int, timeout: float, recycle: int, pre_ping: bool = True):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: List = []
+        self._created_at: Dict[int, float] = {}
+        self._closed = False
+
+    def _connect(self):
+        conn = get_db_connection()
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _is_usable(self, conn) -> bool:
+        created_at = self._created_at.get(id(conn), 0.0)
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Error:
+                return False
+        return True
+
+    def acquire(self):
+        if self._closed:
+            raise HTTPException(status_code=503, detail="Database pool is closed")
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        DB_POOL_WAIT.observe(time.perf_counter() - started)
+        if not acquired:
+            raise HTTPException(status_code=503, detail="Database connection pool exhausted")
+
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_usable(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard: bool = False):
+        try:
+            if discard or self._closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close every idle connection; connections still checked out are closed on release"""
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def open_pool() -> ConnectionPool:
+    """Create the process-wide connection pool (idempotent)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = ConnectionPool(
+                size=settings.DB_POOL_SIZE,
+                timeout=settings.DB_POOL_TIMEOUT,
+                recycle=settings.DB_POOL_RECYCLE,
+                pre_ping=settings.DB_POOL_PRE_PING,
+            )
+        return _pool
+
+def close_pool():
+    """Drain the process-wide connection pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@contextmanager
+def db_connection():
+    """Check a connection out of the pool and always hand it back.
+
+    The transaction is rolled back on error; connections that fail the
+    rollback are dropped instead of being returned to the pool.
+    """
+    pool = _pool or open_pool()
+    conn = pool.acquire()
+    broken = False
     try:
-        # Create audio_processing_records table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS audio_processing_records (
-            id BIGINT PRIMARY KEY AUTO_INCREMENT,
-            process_id VARCHAR(10) NOT NULL,
-            chat_id VARCHAR(100) NOT NULL,
-            user_id VARCHAR(100) NOT NULL,
-            audio_link TEXT NOT NULL,
-            audio_text TEXT,
-            text_summary TEXT,
-            processed_at DATETIME NOT NULL,
-            status VARCHAR(50) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            INDEX idx_chat_user (chat_id, user_id)
-        )
-        """)
-
-        # Create narrative_records table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS narrative_records (
-            id BIGINT PRIMARY KEY AUTO_INCREMENT,
-            visit_id VARCHAR(100) NOT NULL,
-            chat_id VARCHAR(100) NOT NULL,
-            user_id VARCHAR(100) NOT NULL,
-            narrative TEXT,
-            status VARCHAR(50) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            INDEX idx_visit (visit_id),
-            INDEX idx_chat_user (chat_id, user_id)
-        )
-        """)
-        
-        conn.commit()
-        print("Database tables initialized successfully")
-        
-    except Error as e:
-        print(f"Error initializing database: {e}")
-        raise HTTPException(status_code=500, detail="Database initialization error")
-        
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Error:
+            broken = True
+        raise
     finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        pool.release(conn, discard=broken)
+
+
+def ping_database():
+    """Round trip to the database through the pool (blocking, for readiness checks)"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+
+        finally:
+            cursor.close()
+
+
+AUDIO_RECORD_INSERT = """
+INSERT INTO audio_processing_records
+(process_id, chat_id, user_id, audio_link, audio_text, text_summary, processed_at, status)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+NARRATIVE_RECORD_INSERT = """
+INSERT INTO narrative_records
+(visit_id, chat_id, user_id, narrative, status, entry_hashes)
+VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+def _insert_many(query: str, records: List[tuple]):
+    # executemany rewrites a single-row INSERT ... VALUES into one multi-row INSERT
+    if not records:
+        return
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.executemany(query, records)
+            conn.commit()
+
+        finally:
+            cursor.close()
+
+
+def insert_audio_processing_record(record: tuple):
+    """Insert a single row into audio_processing_records (blocking, run in a threadpool)"""
+    _insert_many(AUDIO_RECORD_INSERT, [record])
+
+
+def insert_audio_processing_records(records: List[tuple]):
+    """Insert many audio_processing_records rows in one statement and commit"""
+    _insert_many(AUDIO_RECORD_INSERT, records)
+
+
+def insert_narrative_record(record: tuple):
+    """Insert a single row into narrative_records (blocking, run in a threadpool)"""
+    _insert_many(NARRATIVE_RECORD_INSERT, [record])
+
+
+def insert_narrative_records(records: List[tuple]):
+    """Insert many narrative_records rows in one statement and commit"""
+    _insert_many(NARRATIVE_RECORD_INSERT, records)
+
+
+def insert_processing_records(audio_records: List[tuple], narrative_records: List[tuple]):
+    """Insert audio and narrative rows with one commit, so either all of them are stored or none"""
+    if not audio_records and not narrative_records:
+        return
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            if audio_records:
+                cursor.executemany(AUDIO_RECORD_INSERT, audio_records)
+            if narrative_records:
+                cursor.executemany(NARRATIVE_RECORD_INSERT, narrative_records)
+            conn.commit()
+
+        finally:
+            cursor.close()
+
+
+def get_latest_narrative(visit_id: str, user_id: str) -> Optional[dict]:
+    """Most recent successful narrative for a visit, with the hashes of the entries it covers"""
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            cursor.execute("""
+            SELECT narrative, entry_hashes FROM narrative_records
+            WHERE visit_id = %s AND user_id = %s AND status = 'success'
+            ORDER BY id DESC
+            LIMIT 1
+            """, (visit_id, user_id))
+            return cursor.fetchone()
+
+        finally:
+            cursor.close()
+
+
+def list_records_page(table: str, columns: List[str], filters: Dict[str, str], before_id: Optional[int], limit: int) -> List[dict]:
+    """One page of rows, newest first, using keyset pagination on ``id``.
+
+    ``table`` and ``columns`` are interpolated, so callers must pass
+    whitelisted names only; filter values are bound as parameters.
+    """
+    conditions = [f"{column} = %s" for column in filters]
+    params: list = list(filters.values())
+    if before_id is not None:
+        conditions.append("id < %s")
+        params.append(before_id)
+    where = " AND ".join(conditions) or "1 = 1"
+
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            cursor.execute(f"""
+            SELECT {", ".join(columns)} FROM {table}
+            WHERE {where}
+            ORDER BY id DESC
+            LIMIT %s
+            """, (*params, limit))
+            return cursor.fetchall()
+
+        finally:
+            cursor.close()
+
+
+def open_export_cursor(
+    table: str,
+    columns: List[str],
+    filters: Dict[str, str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+):
+    """Run an export query on a dedicated connection and return (connection, unbuffered cursor).
+
+    Rows are streamed from the server as the cursor is read, so the caller
+    must read with ``fetchmany`` and close both when done. The connection
+    is not taken from the pool, so a long export never holds a pool slot.
+    ``table`` and ``columns`` are interpolated and must be whitelisted.
+    """
+    conditions = [f"{column} = %s" for column in filters]
+    params: list = list(filters.values())
+    if created_from is not None:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to is not None:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+    where = " AND ".join(conditions) or "1 = 1"
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        # The server drops a result set whose client reads slower than net_write_timeout
+        cursor.execute("SET SESSION net_write_timeout = %s", (settings.EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(f"""
+        SELECT {", ".join(columns)} FROM {table}
+        WHERE {where}
+        ORDER BY created_at, id
+        """, tuple(params))
+        return conn, cursor
+    except Exception:
+        conn.close()
+        raise
+
+
+def search_records(
+    table: str,
+    columns: List[str],
+    match_columns: List[str],
+    query: str,
+    anchor: str,
+    snippet_lead: int,
+    snippet_chars: int,
+    filters: Dict[str, str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    limit: int,
+    offset: int,
+) -> List[dict]:
+    """Rows matching ``query`` on the FULLTEXT index over ``match_columns``, most relevant first.
+
+    Returns ``columns``, a ``score`` and, per match column, a short
+    ``<column>_snippet`` around the first occurrence of ``anchor`` with its
+    ``<column>_start`` offset, so the TEXT columns never leave the server
+    whole. Names are interpolated and must be whitelisted; ``match_columns``
+    must be exactly the columns of one FULLTEXT index.
+    """
+    match = f"MATCH({', '.join(match_columns)}) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+    snippets = []
+    snippet_params: list = []
+    for column in match_columns:
+        start = f"GREATEST(1, LOCATE(%s, {column}) - %s)"
+        snippets.append(f"{start} AS {column}_start")
+        snippets.append(f"SUBSTRING({column}, {start}, %s) AS {column}_snippet")
+        snippet_params += [anchor, snippet_lead, anchor, snippet_lead, snippet_chars]
+
+    conditions = [match] + [f"{column} = %s" for column in filters]
+    params: list = [query] + list(filters.values())
+    if created_from is not None:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to is not None:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            cursor.execute(f"""
+            SELECT {", ".join(columns)}, {match} AS score, {", ".join(snippets)}
+            FROM {table}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY score DESC, id DESC
+            LIMIT %s OFFSET %s
+            """, (query, *snippet_params, *params, limit, offset))
+            return cursor.fetchall()
+
+        finally:
+            cursor.close()
+
+
+def get_cached_transcript(audio_sha256: str, model: str) -> Optional[str]:
+    """Look up a stored transcript by audio content hash (blocking, run in a threadpool)"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            SELECT audio_text FROM transcription_cache
+            WHERE audio_sha256 = %s AND model = %s
+            """, (audio_sha256, model))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        finally:
+            cursor.close()
+
+
+def save_cached_transcript(audio_sha256: str, model: str, audio_text: str):
+    """Store a transcript by audio content hash (blocking, run in a threadpool)"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            INSERT INTO transcription_cache (audio_sha256, model, audio_text)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE audio_text = VALUES(audio_text)
+            """, (audio_sha256, model, audio_text))
+            conn.commit()
+
+        finally:
+            cursor.close()
+
+
+def insert_job(job_id: str, username: str, payload: str):
+    """Record a newly submitted audio processing job as queued"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            INSERT INTO audio_processing_jobs (job_id, username, payload, status)
+            VALUES (%s, %s, %s, 'queued')
+            """, (job_id, username, payload))
+            conn.commit()
+
+        finally:
+            cursor.close()
+
+
+def _lease_until(lease_seconds: int) -> datetime:
+    # Computed here rather than with NOW() so every statement compares against the same clock
+    return datetime.utcnow() + timedelta(seconds=lease_seconds)
+
+
+def claim_job(job_id: str, worker_id: str, lease_seconds: int) -> Optional[str]:
+    """Atomically move a queued job to running under a lease; returns its payload, or None if another worker owns it"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            UPDATE audio_processing_jobs
+            SET status = 'running', attempts = attempts + 1, worker_id = %s, leased_until = %s
+            WHERE job_id = %s AND status = 'queued'
+            """, (worker_id, _lease_until(lease_seconds), job_id))
+            conn.commit()
+            if cursor.rowcount != 1:
+                return None
+
+            cursor.execute("SELECT payload FROM audio_processing_jobs WHERE job_id = %s", (job_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        finally:
+            cursor.close()
+
+
+def renew_job_lease(job_id: str, worker_id: str, lease_seconds: int) -> bool:
+    """Extend the lease of a running job; False if the job is no longer ours"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            UPDATE audio_processing_jobs
+            SET leased_until = %s
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+            """, (_lease_until(lease_seconds), job_id, worker_id))
+            conn.commit()
+            return cursor.rowcount == 1
+
+        finally:
+            cursor.close()
+
+
+def finish_job(job_id: str, worker_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> bool:
+    """Store the outcome of a job ('completed' with a result or 'failed' with an error); False if it lost its lease"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            UPDATE audio_processing_jobs
+            SET status = %s, result = %s, error = %s, worker_id = NULL, leased_until = NULL
+            WHERE job_id = %s AND worker_id = %s AND status = 'running'
+            """, (status, result, error, job_id, worker_id))
+            conn.commit()
+            return cursor.rowcount == 1
+
+        finally:
+            cursor.close()
+
+
+def release_jobs(worker_id: str) -> int:
+    """Hand a stopping worker's running jobs back to the queue without waiting for their leases to expire"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            UPDATE audio_processing_jobs
+            SET status = 'queued', worker_id = NULL, leased_until = NULL
+            WHERE worker_id = %s AND status = 'running'
+            """, (worker_id,))
+            conn.commit()
+            return cursor.rowcount
+
+        finally:
+            cursor.close()
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Fetch a job row as a dict"""
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            cursor.execute("""
+            SELECT job_id, username, status, result, error, created_at, updated_at
+            FROM audio_processing_jobs
+            WHERE job_id = %s
+            """, (job_id,))
+            return cursor.fetchone()
+
+        finally:
+            cursor.close()
+
+
+def requeue_expired_jobs() -> List[str]:
+    """Reset running jobs whose worker stopped renewing their lease to queued and return their ids"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            # Jobs claimed before leases existed have none and count as expired
+            now = datetime.utcnow()
+            cursor.execute("""
+            SELECT job_id FROM audio_processing_jobs
+            WHERE status = 'running' AND (leased_until IS NULL OR leased_until < %s)
+            ORDER BY created_at
+            """, (now,))
+            job_ids = [row[0] for row in cursor.fetchall()]
+            requeued = []
+            for job_id in job_ids:
+                # Re-checked per row: the owner may renew or finish it in between
+                cursor.execute("""
+                UPDATE audio_processing_jobs
+                SET status = 'queued', worker_id = NULL, leased_until = NULL
+                WHERE job_id = %s AND status = 'running' AND (leased_until IS NULL OR leased_until < %s)
+                """, (job_id, now))
+                if cursor.rowcount == 1:
+                    requeued.append(job_id)
+            conn.commit()
+            return requeued
+
+        finally:
+            cursor.close()
+
+
+def list_queued_jobs() -> List[str]:
+    """Every queued job id, oldest first"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+            SELECT job_id FROM audio_processing_jobs
+            WHERE status = 'queued'
+            ORDER BY created_at
+            """)
+            return [row[0] for row in cursor.fetchall()]
+
+        finally:
+            cursor.close()
+
+
+def get_user_record(username: str) -> Optional[dict]:
+    """Fetch an API account by username"""
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            cursor.execute("""
+            SELECT username, hashed_password, disabled FROM users
+            WHERE username = %s
+            """, (username,))
+            return cursor.fetchone()
+
+        finally:
+            cursor.close()
+
+
+def insert_missing_users(users: List[tuple]):
+    """Create (username, hashed_password, disabled) accounts that do not exist yet"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.executemany("""
+            INSERT IGNORE INTO users (username, hashed_password, disabled)
+            VALUES (%s, %s, %s)
+            """, users)
+            conn.commit()
+
+        finally:
+            cursor.close()
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import time
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from .config import get_settings
+from .metrics import AUDIO_DOWNLOADED_BYTES
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class AudioTooLargeError(Exception):
+    """Raised when a remote audio file exceeds AUDIO_MAX_BYTES"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Audio file exceeds the {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
+
+class DownloadedAudio:
+    """A downloaded audio file: a per-request spooled temp file, or an open file in the audio store"""
+
+    def __init__(self, file: BinaryIO, filename: str, size: int, sha256: str):
+        self.file = file
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+    def fileno(self) -> int:
+        """OS-level descriptor positioned at the start, e.g. to pipe into ffmpeg"""
+        if isinstance(self.file, SpooledTemporaryFile):
+            self.file.rollover()
+        self.file.seek(0)
+        return self.file.fileno()
+
+    def upload_file(self):
+        """(filename, fileobj) tuple accepted by the OpenAI client"""
+        self.file.seek(0)
+        return (self.filename, self.file)
+
+    def close(self):
+        self.file.close()
+
+
+def filename_for(url: str) -> str:
+    # Whisper infers the audio format from the upload's file extension
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    return f"audio{extension or '.mp3'}"
+
+
+async def receive_audio(response: httpx.Response, file: BinaryIO) -> Tuple[int, str]:
+    """Write the body of ``response`` to ``file`` in fixed-size chunks; returns (size, sha256).
+
+    Aborts with AudioTooLargeError as soon as the body exceeds
+    AUDIO_MAX_BYTES. The content is hashed as it streams in so the
+    transcript cache can be consulted without re-reading the file.
+    """
+    max_bytes = settings.AUDIO_MAX_BYTES
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise AudioTooLargeError(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    started = time.perf_counter()
+    async for chunk in response.aiter_bytes(settings.AUDIO_DOWNLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise AudioTooLargeError(max_bytes)
+        digest.update(chunk)
+        file.write(chunk)
+
+    AUDIO_DOWNLOADED_BYTES.inc(size)
+    elapsed = time.perf_counter() - started
+    throughput = size / elapsed / 1024 / 1024 if elapsed > 0 else 0.0
+    logger.info(f"Downloaded {size} bytes in {elapsed:.2f}s ({throughput:.2f} MB/s)")
+    return size, digest.hexdigest()
+
+
+async def download_audio(http_client: httpx.AsyncClient, url: str) -> DownloadedAudio:
+    """Stream ``url`` into a spooled temp file.
+
+    Small files stay in memory, larger ones spill to disk, so memory use is
+    bounded by AUDIO_SPOOL_MAX_SIZE regardless of the file size.
+    """
+    spool = SpooledTemporaryFile(max_size=settings.AUDIO_SPOOL_MAX_SIZE)
+
+    try:
+        async with http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            size, sha256 = await receive_audio(response, spool)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return DownloadedAudio(spool, filename_for(url), size, sha256)
@@ -0,0 +1,223 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from mysql.connector import Error
+
+from .auth.models import User
+from .auth.utils import get_current_active_user
+from .config import get_settings
+from .database import open_export_cursor
+from .history import AUDIO_FIELDS, AUDIO_TABLE, NARRATIVE_FIELDS, NARRATIVE_TABLE, parse_fields
+from .metrics import EXPORT_ROWS
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+EXPORT_TABLES = {
+    "transcripts": (AUDIO_TABLE, AUDIO_FIELDS),
+    "narratives": (NARRATIVE_TABLE, NARRATIVE_FIELDS),
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def get_export_admin(current_user: User = Depends(get_current_active_user)) -> User:
+    if current_user.username not in settings.EXPORT_ADMINS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Exports are restricted to administrators")
+    return current_user
+
+
+class RecordExport:
+    """Streams one table as NDJSON or CSV, optionally gzipped.
+
+    ``open`` runs the query on an unbuffered server-side cursor; ``chunks``
+    reads it EXPORT_FETCH_SIZE rows at a time and encodes each batch as it
+    arrives, so memory stays flat however many rows match.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        user_id: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        fmt: str = "ndjson",
+        compress: bool = False,
+        fields: Optional[str] = None,
+    ):
+        if kind not in EXPORT_TABLES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown export '{kind}'. Available: {', '.join(EXPORT_TABLES)}"
+            )
+        if fmt not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown format '{fmt}'. Available: {', '.join(MEDIA_TYPES)}"
+            )
+        if created_from and created_to and created_from >= created_to:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="created_from must be before created_to")
+
+        self.kind = kind
+        self.table, allowed = EXPORT_TABLES[kind]
+        self.columns: List[str] = parse_fields(fields, allowed, allowed)
+        self.user_id = user_id
+        self.created_from = created_from
+        self.created_to = created_to
+        self.fmt = fmt
+        self.compress = compress
+        self.rows = 0
+        self._conn = None
+        self._cursor = None
+
+    @property
+    def media_type(self) -> str:
+        return "application/gzip" if self.compress else MEDIA_TYPES[self.fmt]
+
+    @property
+    def filename(self) -> str:
+        name = f"{self.kind}-{self.user_id or 'all'}-{datetime.utcnow():%Y%m%d%H%M%S}.{self.fmt}"
+        return name + ".gz" if self.compress else name
+
+    def open(self):
+        """Start the query on a dedicated connection (blocking)"""
+        filters = {"user_id": self.user_id} if self.user_id else {}
+        self._conn, self._cursor = open_export_cursor(
+            self.table, self.columns, filters, self.created_from, self.created_to
+        )
+
+    def close(self):
+        # Closing mid-result drops the rest of the stream with the connection
+        cursor, conn = self._cursor, self._conn
+        self._cursor = self._conn = None
+        for resource in (cursor, conn):
+            if resource is None:
+                continue
+            try:
+                resource.close()
+            except Error:
+                pass
+
+    def _batches(self) -> Iterator[List[dict]]:
+        while True:
+            rows = self._cursor.fetchmany(settings.EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            self.rows += len(rows)
+            EXPORT_ROWS.labels(self.table).inc(len(rows))
+            yield rows
+
+    def _encoded(self) -> Iterator[bytes]:
+        if self.fmt == "ndjson":
+            for rows in self._batches():
+                yield "".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in rows).encode()
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        for rows in self._batches():
+            writer.writerows([row[column] for column in self.columns] for row in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            # Header of an empty export
+            yield buffer.getvalue().encode()
+
+    def chunks(self) -> Iterator[bytes]:
+        """Body of the export (blocking iterator); closes the cursor when exhausted or closed"""
+        try:
+            if not self.compress:
+                yield from self._encoded()
+                return
+            # wbits=31 writes a gzip container
+            compressor = zlib.compressobj(settings.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+            for data in self._encoded():
+                compressed = compressor.compress(data)
+                if compressed:
+                    yield compressed
+            yield compressor.flush()
+        except Error as e:
+            # Headers are already sent; the client sees a truncated body
+            logger.error(f"Export of {self.table} failed after {self.rows} rows: {str(e)}", exc_info=True)
+            raise
+        finally:
+            self.close()
+            logger.info(f"Exported {self.rows} rows from {self.table}")
+
+
+async def stream_export(
+    kind: str,
+    user_id: Optional[str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    fmt: str,
+    compress: bool,
+    fields: Optional[str],
+) -> StreamingResponse:
+    export = RecordExport(kind, user_id, created_from, created_to, fmt, compress, fields)
+    try:
+        # Run the query before responding so connection and SQL errors still get a status code
+        await run_in_threadpool(export.open)
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    return StreamingResponse(
+        export.chunks(),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'}
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export transcripts or narratives as NDJSON or CSV")
+    parser.add_argument("kind", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--user-id", help="Only rows of this user")
+    parser.add_argument("--from", dest="created_from", type=datetime.fromisoformat,
+                        help="created_at lower bound, inclusive (ISO date or datetime)")
+    parser.add_argument("--to", dest="created_to", type=datetime.fromisoformat,
+                        help="created_at upper bound, exclusive (ISO date or datetime)")
+    parser.add_argument("--format", dest="fmt", choices=sorted(MEDIA_TYPES), default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+    parser.add_argument("--fields", help="Comma-separated columns (default: all)")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        export = RecordExport(args.kind, args.user_id, args.created_from, args.created_to, args.fmt, args.gzip, args.fields)
+        export.open()
+    except HTTPException as e:
+        parser.error(e.detail)
+    except Error as e:
+        logger.error(f"Database error: {str(e)}")
+        return 1
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export.chunks():
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
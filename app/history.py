@@ -0,0 +1,110 @@
+import base64
+import binascii
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+
+from .config import get_settings
+from .database import list_records_page
+from .metrics import track_stage
+from .models import RecordPage
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+AUDIO_TABLE = "audio_processing_records"
+NARRATIVE_TABLE = "narrative_records"
+
+# Selectable columns per table; the defaults are served from the covering
+# indexes, the TEXT columns have to be asked for explicitly
+AUDIO_FIELDS = (
+    "id", "process_id", "chat_id", "user_id", "audio_link", "audio_text",
+    "text_summary", "processed_at", "status", "created_at",
+)
+AUDIO_DEFAULT_FIELDS = ("id", "process_id", "chat_id", "user_id", "processed_at", "status", "created_at")
+
+NARRATIVE_FIELDS = ("id", "visit_id", "chat_id", "user_id", "narrative", "status", "entry_hashes", "created_at")
+NARRATIVE_DEFAULT_FIELDS = ("id", "visit_id", "chat_id", "user_id", "status", "created_at")
+
+
+def encode_cursor(record_id: int) -> str:
+    return base64.urlsafe_b64encode(str(record_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Record id (history) or offset (search) in a cursor; anything but a non-negative integer is a 400"""
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        # Digits only: no sign, so a crafted negative offset never reaches the SQL
+        if not value.isdigit():
+            raise ValueError(value)
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: Tuple[str, ...], default: Tuple[str, ...]) -> List[str]:
+    """Requested columns from a comma-separated ``fields`` value; ``id`` is always included"""
+    if not fields:
+        return list(default)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(allowed)}"
+        )
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def page_size(limit: int) -> int:
+    return max(1, min(limit, settings.HISTORY_MAX_PAGE_SIZE))
+
+
+async def _read_page(table: str, columns: List[str], filters: Dict[str, str], cursor: Optional[str], limit: int) -> RecordPage:
+    limit = page_size(limit)
+    try:
+        with track_stage("history", table):
+            # One extra row tells whether there is a next page
+            rows = await run_in_threadpool(list_records_page, table, columns, filters, decode_cursor(cursor), limit + 1)
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    next_cursor = encode_cursor(rows[limit - 1]["id"]) if len(rows) > limit else None
+    return RecordPage(items=rows[:limit], next_cursor=next_cursor)
+
+
+async def audio_history(chat_id: str, user_id: str, fields: Optional[str], cursor: Optional[str], limit: int) -> RecordPage:
+    """Audio processing records of one chat and user, newest first"""
+    columns = parse_fields(fields, AUDIO_FIELDS, AUDIO_DEFAULT_FIELDS)
+    return await _read_page(AUDIO_TABLE, columns, {"chat_id": chat_id, "user_id": user_id}, cursor, limit)
+
+
+async def narrative_history(
+    visit_id: Optional[str],
+    chat_id: Optional[str],
+    user_id: Optional[str],
+    fields: Optional[str],
+    cursor: Optional[str],
+    limit: int,
+) -> RecordPage:
+    """Narrative records of a visit, or of a chat and user, newest first"""
+    if not visit_id and not (chat_id and user_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Filter by visit_id, or by both chat_id and user_id"
+        )
+    filters = {
+        column: value
+        for column, value in (("visit_id", visit_id), ("chat_id", chat_id), ("user_id", user_id))
+        if value
+    }
+    columns = parse_fields(fields, NARRATIVE_FIELDS, NARRATIVE_DEFAULT_FIELDS)
+    return await _read_page(NARRATIVE_TABLE, columns, filters, cursor, limit)
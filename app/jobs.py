@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import List, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from .config import get_settings
+from .database import (
+    claim_job, finish_job, insert_job, list_queued_jobs, release_jobs, renew_job_lease, requeue_expired_jobs
+)
+from .logging_config import request_id_var
+from .models import AudioProcessingInput
+from .pipeline import run_audio_pipeline
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class JobWorkerPool:
+    """Runs audio processing jobs on a fixed number of in-process workers.
+
+    Job state lives in the ``audio_processing_jobs`` table; the asyncio queue
+    only carries job ids, so queued jobs are picked up again from the table
+    on the next startup. A claimed job is leased to this process
+    (``worker_id``) for JOB_LEASE_SECONDS and the lease is renewed while it
+    runs, so other processes leave it alone; once a lease expires because
+    its process died, the next startup or reaper pass of any process
+    requeues the job. The reaper also takes on jobs that stayed queued for a
+    whole pass without being in its own queue, e.g. released by a stopping
+    process or queued in one that died.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queue: "Optional[asyncio.Queue[str]]" = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Set[str] = set()  # Job ids in self.queue
+        self._seen_queued: Set[str] = set()  # Queued in the table at the previous reaper pass
+
+    async def start(self):
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue()
+        requeued = await run_in_threadpool(requeue_expired_jobs)
+        if requeued:
+            logger.info(f"Re-queued {len(requeued)} audio jobs with expired leases")
+        job_ids = await run_in_threadpool(list_queued_jobs)
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        if job_ids:
+            logger.info(f"Queued {len(job_ids)} pending audio jobs")
+
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+        try:
+            released = await run_in_threadpool(release_jobs, self.worker_id)
+        except Exception:
+            # Their leases expire and another process requeues them
+            logger.error("Failed to release running audio jobs", exc_info=True)
+            return
+        if released:
+            logger.info(f"Released {released} running audio jobs back to the queue")
+
+    async def submit(self, input: AudioProcessingInput, username: str) -> str:
+        if self.queue is None:
+            raise HTTPException(status_code=503, detail="Job workers are starting, try again shortly")
+        job_id = uuid.uuid4().hex
+        await run_in_threadpool(insert_job, job_id, username, input.model_dump_json())
+        self._enqueue(job_id)
+        logger.info(f"Queued audio job {job_id} for chat_id: {input.chat_id}")
+        return job_id
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._pending:
+            self._pending.add(job_id)
+            self.queue.put_nowait(job_id)
+
+    async def _worker(self, n: int):
+        while True:
+            job_id = await self.queue.get()
+            self._pending.discard(job_id)
+            token = request_id_var.set(job_id)
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.error(f"Job worker {n} failed to run job {job_id}", exc_info=True)
+            finally:
+                request_id_var.reset(token)
+                self.queue.task_done()
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS)
+            try:
+                await self._reap()
+            except Exception:
+                logger.error("Failed to re-queue abandoned audio jobs", exc_info=True)
+
+    async def _reap(self):
+        """Take on running jobs whose lease expired and queued jobs no live process picked up"""
+        requeued = await run_in_threadpool(requeue_expired_jobs)
+        for job_id in requeued:
+            self._enqueue(job_id)
+        if requeued:
+            logger.warning(f"Re-queued {len(requeued)} audio jobs with expired leases")
+
+        # Queued since the last pass, so the process that queued them is gone or not getting to them
+        queued = set(await run_in_threadpool(list_queued_jobs))
+        stale = (queued & self._seen_queued) - self._pending
+        self._seen_queued = queued
+        for job_id in stale:
+            self._enqueue(job_id)
+        if stale:
+            logger.info(f"Picked up {len(stale)} audio jobs left queued by other processes")
+
+    async def _heartbeat(self, job_id: str):
+        """Renew the lease of a running job; returns once the lease is lost"""
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            try:
+                renewed = await run_in_threadpool(renew_job_lease, job_id, self.worker_id, settings.JOB_LEASE_SECONDS)
+            except Exception:
+                # Retried on the next beat; the lease outlives two missed renewals
+                logger.warning(f"Failed to renew the lease of audio job {job_id}", exc_info=True)
+                continue
+            if not renewed:
+                return
+
+    async def _process(self, payload: str):
+        return await run_audio_pipeline(AudioProcessingInput.model_validate_json(payload))
+
+    async def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        if not await run_in_threadpool(finish_job, job_id, self.worker_id, status, result, error):
+            logger.warning(f"Discarded the outcome of audio job {job_id}: its lease expired and it was re-queued")
+
+    async def _run(self, job_id: str):
+        payload = await run_in_threadpool(claim_job, job_id, self.worker_id, settings.JOB_LEASE_SECONDS)
+        if payload is None:
+            return
+
+        logger.info(f"Running audio job {job_id}")
+        pipeline = asyncio.create_task(self._process(payload))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await asyncio.wait({pipeline, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Either the pipeline finished, the lease was lost, or the pool is stopping
+            heartbeat.cancel()
+            pipeline.cancel()
+            await asyncio.gather(pipeline, heartbeat, return_exceptions=True)
+
+        if pipeline.cancelled():
+            logger.warning(f"Stopped audio job {job_id}: its lease expired and another worker may run it")
+            return
+        try:
+            output = pipeline.result()
+        except HTTPException as e:
+            await self._finish(job_id, "failed", None, str(e.detail))
+            logger.warning(f"Audio job {job_id} failed: {e.detail}")
+            return
+        except Exception as e:
+            await self._finish(job_id, "failed", None, str(e))
+            logger.error(f"Audio job {job_id} failed", exc_info=True)
+            return
+
+        await self._finish(job_id, "completed", output.model_dump_json())
+        logger.info(f"Audio job {job_id} completed")
+
+
+job_pool = JobWorkerPool(settings.JOB_WORKERS)
@@ -1,18 +1,116 @@
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
+import zlib
+from contextvars import ContextVar
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from .config import get_settings
+
+# Correlation id of the request (or background job) currently being handled
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# High-volume INFO loggers on the /process_audio/ path that LOG_SAMPLE_RATE applies to
+SAMPLED_LOGGERS = ("app.pipeline", "app.downloads", "app.transcript_cache")
+
+_configured = False
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current correlation id"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the INFO lines from SAMPLED_LOGGERS.
+
+    The decision is made per correlation id, so a sampled request keeps all
+    of its lines. Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(rate, 1.0)) * 10000)
+
+    def filter(self, record):
+        if record.levelno != logging.INFO or not record.name.startswith(SAMPLED_LOGGERS):
+            return True
+        request_id = getattr(record, "request_id", request_id_var.get())
+        return zlib.crc32(request_id.encode("utf-8")) % 10000 < self.threshold
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry)
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler that keeps the traceback separate from the message.
+
+    The stock handler folds the formatted traceback into ``msg``, which would
+    hide it from JsonFormatter's ``exc_info`` field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _build_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s'
+    )
+
 
 def setup_logging():
+    """Configure the root logger once; later calls return it unchanged.
+
+    With LOG_QUEUE enabled the request path only enqueues records and a
+    background QueueListener thread does the file and console writes.
+    """
+    global _configured, _listener
+
+    logger = logging.getLogger()
+    if _configured:
+        return logger
+
+    settings = get_settings()
+
     # Create logs directory if it doesn't exist
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
-    
+
     # Configure logging format
-    log_format = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
+    log_format = _build_formatter(settings.LOG_FORMAT)
+
     # Setup file handler for all logs
     file_handler = RotatingFileHandler(
         'logs/app.log',
@@ -20,7 +118,7 @@ def setup_logging():
         backupCount=5
     )
     file_handler.setFormatter(log_format)
-    
+
     # Setup error file handler
     error_handler = RotatingFileHandler(
         'logs/error.log',
@@ -29,18 +127,37 @@ def setup_logging():
     )
     error_handler.setFormatter(log_format)
     error_handler.setLevel(logging.ERROR)
-    
+
     # Setup console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(log_format)
-    
-    # Get the root logger
-    logger = logging.getLogger()
+
+    handlers = [file_handler, error_handler, console_handler]
+    filters = [RequestIdFilter(), SamplingFilter(settings.LOG_SAMPLE_RATE)]
+
     logger.setLevel(logging.INFO)
-    
-    # Add handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(error_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+
+    if settings.LOG_QUEUE:
+        queue_handler = _QueueHandler(queue.SimpleQueue())
+        for log_filter in filters:
+            queue_handler.addFilter(log_filter)
+        _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        logger.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            for log_filter in filters:
+                handler.addFilter(log_filter)
+            logger.addHandler(handler)
+
+    _configured = True
+    return logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,17 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, Request, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import timedelta
-import logging
-import os
-import requests
+from datetime import datetime, timedelta
+import uuid
 
 from .config import get_settings
-from .database import get_db_connection, init_db
+from .database import close_pool, get_job, open_pool
+from .export import get_export_admin, stream_export
+from .admission import AdmissionMiddleware
+from .batch import run_audio_batch, run_narrative_batch
+from .history import audio_history, narrative_history
+from .search import search
+from .jobs import job_pool
+from .migrations import migrate
+from .pipeline import NARRATIVE_MODEL, SUMMARY_MODEL, close_clients, run_audio_pipeline, run_narrative_pipeline
+from .prompts import warm_tokenizers
+from .profiling import ProfilingMiddleware, get_profiling_admin, list_profiles, load_profile
+from .write_behind import write_behind
+from .streaming import stream_audio_summary, stream_narrative
 from .models import (
+    AudioBatchOutput,
+    AudioJobStatus,
+    AudioJobSubmitted,
     AudioProcessingInput,
     AudioProcessingOutput,
+    NarrativeBatchOutput,
     NarrativeInput,
-    NarrativeOutput
+    NarrativeOutput,
+    RecordPage
 )
 from .auth.models import Token, User
 from .auth.utils import (
@@ -19,15 +36,12 @@ from .auth.utils import (
     authenticate_user,
     create_access_token,
     get_current_active_user,
-    fake_users_db
+    seed_default_users
 )
-from .logging_config import setup_logging
-from openai import OpenAI
-from datetime import datetime
-from typing import List
-import mysql.connector
-from mysql.connector import Error
-import json
+from .metrics import render_metrics
+from .readiness import readiness
+from .logging_config import request_id_var, setup_logging, shutdown_logging
+from typing import List, Optional
 
 # Initialize logging
 logger = setup_logging()
@@ -35,21 +49,71 @@ logger = setup_logging()
 # Initialize settings
 settings = get_settings()
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
 
 # FastAPI application
 app = FastAPI(title="Jarvic Health API")
+app.add_middleware(AdmissionMiddleware)
+if settings.PROFILING_ADMINS:
+    # Outside admission control, so queueing time is part of a profile's wall time
+    app.add_middleware(ProfilingMiddleware)
+
+async def initialize():
+    """Load tokenizers, bring the schema up to date, seed accounts and start background workers"""
+    await run_in_threadpool(warm_tokenizers, [SUMMARY_MODEL, NARRATIVE_MODEL])
+    await run_in_threadpool(migrate)
+    await run_in_threadpool(seed_default_users)
+    if settings.WRITE_BEHIND:
+        await write_behind.start()
+    await job_pool.start()
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup"""
+    """Open the database pool and start initialization in the background; see /ready"""
     logger.info("Starting up the application")
-    init_db()
+    open_pool()
+    readiness.start(initialize)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers, flush buffered records and release shared clients on shutdown"""
+    logger.info("Shutting down the application")
+    await readiness.stop()
+    await job_pool.stop()
+    await write_behind.stop()
+    await close_clients()
+    await run_in_threadpool(close_pool)
+    shutdown_logging()
+
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """Tag every log line of a request with its X-Request-ID (generated if absent)"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """Readiness probe: 200 once startup has finished and the database answers, 503 otherwise"""
+    is_ready, checks = await readiness.check()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if is_ready else "not_ready", "checks": checks}
+    )
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -69,237 +133,141 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 @app.post("/process_audio/", response_model=AudioProcessingOutput)
 async def process_audio(
     input: AudioProcessingInput,
+    stream: bool = Query(False, description="Stream the summary as server-sent events"),
     current_user: User = Depends(get_current_active_user)
 ):
     logger.info(f"User {current_user.username} processing audio request for chat_id: {input.chat_id}")    
-    # Fallback audio file if link is invalid
-    default_audio_path = "/app/audio.mp3"
-    temp_audio_path = "/tmp/downloaded_audio.mp3"
-    audio_file_to_use = default_audio_path
-
-    try:
-        # Attempt to download audio file
-        try:
-            logger.info(f"Attempting to download audio from: {input.audio_link}")
-            response = requests.get(input.audio_link, stream=True, timeout=10)
-            response.raise_for_status()
-            
-            # Save downloaded audio to temporary location
-            with open(temp_audio_path, "wb") as f:
-                f.write(response.content)
-            audio_file_to_use = temp_audio_path
-            logger.info("Audio file downloaded successfully")
-            
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Failed to download audio: {str(e)}")
-            if os.path.exists(default_audio_path):
-                logger.info("Using default audio.mp3 as fallback :", default_audio_path)
-                audio_file_to_use = default_audio_path
-            else:
-                logger.error("Default audio file not found", default_audio_path)
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Both download and fallback audio file unavailable"
-                )
+    if stream:
+        return await stream_audio_summary(input)
+    return await run_audio_pipeline(input)
 
-        # Transcribe audio file
-        try:
-            logger.info(f"Starting audio transcription using file: {audio_file_to_use}")
-            with open(audio_file_to_use, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
-            transcript_text = transcription.text
-            logger.info("Audio transcription completed successfully")
-        except Exception as e:
-            logger.error("Error during transcription", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Transcription failed: {str(e)}"
-            )
-
-        # Generate summary
-        try:
-            logger.info("Generating summary using GPT-4")
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", 
-                    "content": f"""
-                    You are an assistant specialized in analyzing audio transcriptions from nurses and generating concise, well-structured patient health reports.
-                    Input:
-                    You will receive a transcription summarizing the patient’s current health status.
-
-                    Expected Output:
-                    1. A clear and organized summary of the patient’s health report, emphasizing key details.
-                    2. Use natural language, ensuring all important details are included.
-                    3. Do not assume any information that is not explicitly provided in the transcription.
-                    4. Do not use any symbols like \n\n(slash n), **, etc. Just normal paragraph. Directly start with the summary. Do not use anything like "Summary:" or "Patient's Health Report:".
-                    Transcription Provided:
-                    {transcript_text}
-
-                    Example Output:
-                    The patient, Jane Smith, aged 54, was admitted on December 10th for severe headaches and dizziness. Initial vitals included a blood pressure of 140/90 and a heart rate of 85 bpm. A CT scan indicated mild cerebral edema. By December 11th, the headache intensity had reduced, though dizziness persisted. Continued NSAID treatment and physical therapy were recommended. Discharge is tentatively planned for December 15th, pending results.
-                    """},
-                ]
-            )
-            summary = completion.choices[0].message.content
-            logger.info("Summary generation completed")
-        except Exception as e:
-            logger.error("Error generating summary", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Summary generation failed: {str(e)}"
-            )
-
-        # Prepare output
-        process_id = f"{input.chat_id}{input.user_id}"[-5:]
-        output = AudioProcessingOutput(
-            process_id=process_id,
-            audio_link=input.audio_link if audio_file_to_use != default_audio_path else "default_audio",
-            audio_text=transcript_text,
-            text_summary=summary,
-            processed_at=datetime.utcnow().isoformat() + "Z",
-            status="completed"
+def check_batch_size(items: list):
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds {settings.BATCH_MAX_ITEMS} items"
         )
 
-        # Save to database
-        try:
-            logger.info(f"Saving audio processing record to database for process_id: {process_id}")
-            conn = get_db_connection()
-            with conn.cursor() as cursor:
-                insert_query = """
-                INSERT INTO audio_processing_records 
-                (process_id, chat_id, user_id, audio_link, audio_text, text_summary, processed_at, status)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cursor.execute(insert_query, (
-                    output.process_id,
-                    input.chat_id,
-                    input.user_id,
-                    output.audio_link,
-                    output.audio_text,
-                    output.text_summary,
-                    datetime.utcnow(),
-                    output.status
-                ))
-                conn.commit()
-            
-            logger.info("Database record saved successfully")
-            return output
-            
-        except Error as e:
-            logger.error(f"Database error: {str(e)}", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Database error: {str(e)}"
-            )
+@app.post("/process_audio/batch", response_model=AudioBatchOutput)
+async def process_audio_batch(
+    inputs: List[AudioProcessingInput],
+    current_user: User = Depends(get_current_active_user)
+):
+    check_batch_size(inputs)
+    logger.info(f"User {current_user.username} processing audio batch of {len(inputs)} items")
+    return await run_audio_batch(inputs)
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"An unexpected error occurred: {str(e)}"
-        )
-    finally:
-        # Clean up downloaded audio file if it exists
-        if os.path.exists(temp_audio_path):
-            try:
-                os.remove(temp_audio_path)
-                logger.info("Cleaned up temporary audio file")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary audio file: {str(e)}")
+@app.post("/process_audio/jobs", response_model=AudioJobSubmitted, status_code=status.HTTP_202_ACCEPTED)
+async def submit_audio_job(
+    input: AudioProcessingInput,
+    current_user: User = Depends(get_current_active_user)
+):
+    logger.info(f"User {current_user.username} submitting audio job for chat_id: {input.chat_id}")
+    job_id = await job_pool.submit(input, current_user.username)
+    return AudioJobSubmitted(job_id=job_id, status="queued")
+
+@app.get("/process_audio/jobs/{job_id}", response_model=AudioJobStatus)
+async def get_audio_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None or job["username"] != current_user.username:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return AudioJobStatus(
+        job_id=job["job_id"],
+        status=job["status"],
+        result=AudioProcessingOutput.model_validate_json(job["result"]) if job["result"] else None,
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"]
+    )
 
 @app.post("/combine_narrative/", response_model=NarrativeOutput)
 async def combine_narrative(
     input: NarrativeInput,
+    stream: bool = Query(False, description="Stream the narrative as server-sent events"),
+    incremental: bool = Query(False, description="Only send entries not covered by the stored narrative for this visit"),
     current_user: User = Depends(get_current_active_user)
 ):
     logger.info(f"User {current_user.username} processing narrative request for visit_id: {input.visit_id}")    
-    try:
-        # Join entries
-        combined_input = "\n\n".join(input.entries)
-        logger.debug(f"Combined input entries: {combined_input[:200]}...")  # Log first 200 chars
+    if stream:
+        return await stream_narrative(input, incremental)
+    return await run_narrative_pipeline(input, incremental=incremental)
+
+@app.post("/combine_narrative/batch", response_model=NarrativeBatchOutput)
+async def combine_narrative_batch(
+    inputs: List[NarrativeInput],
+    current_user: User = Depends(get_current_active_user)
+):
+    check_batch_size(inputs)
+    logger.info(f"User {current_user.username} processing narrative batch of {len(inputs)} items")
+    return await run_narrative_batch(inputs)
 
-        # Generate narrative using GPT-4
-        try:
-            logger.info("Generating narrative using GPT-4")
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", 
-                    "content": """
-                    You are a nurse creating a comprehensive narrative for a patient's health record.
-                    Input: You will receive multiple entries summarizing the patient's health at different times.
-                    Expected Output:
-                    1. Combine all entries into a single cohesive narrative.
-                    2. Use natural language and proper formatting to ensure clarity and flow.
-                    3. Ensure details are structured in chronological order, and avoid redundancies.
-                    4. Do not assume any information that is not explicitly provided in the entries.
-                    5. Do not use any symbols like \n\n(slash n), **, etc. Just normal paragraph.
-                    6. Try to keep the structure similar to the exmaple below:
-                    
-                    07:00 Skilled nurse arrives at home and receives patient from outgoing nurse who stated that patient had a good day start of shift vital signs 07:00 Skilled nurse arrives at home and receives patient from outgoing nurse who stated that patient had a good day start of shift vital signs checked and documented, family and Patient covid assessment was done according to CDC guidelines, Pt and SN temp. monitored and checked and documented, family and Patient covid assessment was done according to CDC guidelines, Pt and SN temp. monitored and recorded, all within normal limit, Pt head to toe assessment done, pt remains stable, lungs sounds present and clear. At 14:05, Pt had a large sized soft stool and was well cleaned, incontinent care done and new diaper worn. At 15:00 due medication AFOS 4 to 14:05, Pt had a large sized soft stool and was well cleaned, incontinent care done and new diaper worn. At 15:00 due medication AFOS 4 to 8 hrs as tolerated, Pt continue feeding, will continue monitoring. At 15:00 Pt vital signs checked and recorded, Pt continues feeding, will 8 hrs as tolerated, Pt continue feeding, will continue monitoring. At 15:00 Pt vital signs checked and recorded, Pt continues feeding, will continue monitoring, Pt repositioned every 2hrs to prevent skin irritations and to maintain skin integrity. No new concern at this time, pt remains stable, End of shift report given to incoming Trash emptied, emergency equipments at pt bedside. No new concern at this time, pt remains stable, End of shift report given to incoming nurse, Nurse off the clock.
-                    """
-                    },
-                    {"role": "user", "content": combined_input},
-                ]
-            )
-            narrative = completion.choices[0].message.content
-            logger.info("Narrative generation completed")
-            logger.debug(f"Generated narrative: {narrative[:200]}...")  # Log first 200 chars
-        except Exception as e:
-            logger.error("Error generating narrative", exc_info=True)
-            raise HTTPException(status_code=500, detail="Narrative generation failed")
+@app.get("/history/audio", response_model=RecordPage)
+async def read_audio_history(
+    chat_id: str,
+    user_id: str,
+    fields: Optional[str] = Query(None, description="Comma-separated columns; defaults leave out audio_link, audio_text and text_summary"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_active_user)
+):
+    return await audio_history(chat_id, user_id, fields, cursor, limit)
 
-        # Prepare output
-        output = NarrativeOutput(
-            visit_id=input.visit_id,
-            chat_id=input.chat_id,
-            user_id=input.user_id,
-            narrative=narrative,
-            status="success"
-        )
+@app.get("/history/narratives", response_model=RecordPage)
+async def read_narrative_history(
+    visit_id: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated columns; defaults leave out narrative and entry_hashes"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_active_user)
+):
+    return await narrative_history(visit_id, chat_id, user_id, fields, cursor, limit)
 
-        # Save to database
-        try:
-            logger.info(f"Saving narrative record to database for visit_id: {input.visit_id}")
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            insert_query = """
-            INSERT INTO narrative_records 
-            (visit_id, chat_id, user_id, narrative, status)
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            
-            cursor.execute(insert_query, (
-                output.visit_id,
-                output.chat_id,
-                output.user_id,
-                output.narrative,
-                output.status
-            ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            logger.info("Database record saved successfully")
-            
-        except Error as e:
-            logger.error(f"Database error: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail="Database error")
+@app.get("/search/{kind}", response_model=RecordPage)
+async def full_text_search(
+    kind: str,
+    q: str = Query(..., min_length=1, max_length=200, description="Words to look for, e.g. fall or wound dressing"),
+    user_id: Optional[str] = None,
+    chat_id: Optional[str] = None,
+    created_from: Optional[datetime] = Query(None, description="created_at lower bound, inclusive"),
+    created_to: Optional[datetime] = Query(None, description="created_at upper bound, exclusive"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Transcripts or narratives ranked by relevance to ``q``, with snippets around the match"""
+    logger.info(f"User {current_user.username} searching {kind}")
+    return await search(kind, q, user_id, chat_id, created_from, created_to, cursor, limit)
+
+@app.get("/export/{kind}")
+async def export_records(
+    kind: str,
+    user_id: Optional[str] = None,
+    created_from: Optional[datetime] = Query(None, description="created_at lower bound, inclusive"),
+    created_to: Optional[datetime] = Query(None, description="created_at upper bound, exclusive"),
+    format: str = Query("ndjson", description="ndjson or csv"),
+    gzip: bool = Query(False, description="Gzip the body on the fly"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns; all by default"),
+    current_user: User = Depends(get_export_admin)
+):
+    """Stream transcripts or narratives for compliance exports (EXPORT_ADMINS only); memory use is independent of the row count"""
+    logger.info(f"User {current_user.username} exporting {kind} for user {user_id or 'all'}")
+    return await stream_export(kind, user_id, created_from, created_to, format, gzip, fields)
 
-        logger.info(f"Narrative combination completed successfully for visit_id: {input.visit_id}")
-        return output
+@app.get("/debug/profiles")
+async def read_profiles(current_user: User = Depends(get_profiling_admin)):
+    return await run_in_threadpool(list_profiles)
 
-    except Exception as e:
-        logger.error(f"Unexpected error in combine_narrative: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/debug/profiles/{profile_id}")
+async def read_profile(profile_id: str, current_user: User = Depends(get_profiling_admin)):
+    profile = await run_in_threadpool(load_profile, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return profile
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -0,0 +1,158 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Stage latencies for the audio (download, preprocess, transcription, prompt,
+# summary, db_insert) and narrative (history_lookup, prompt, generation,
+# db_insert) pipelines, plus write_behind flushes
+STAGE_LATENCY = Histogram(
+    "jarvic_stage_duration_seconds",
+    "Latency of each pipeline stage",
+    ["pipeline", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+STAGE_ERRORS = Counter(
+    "jarvic_stage_errors_total",
+    "Pipeline stages that raised an error",
+    ["pipeline", "stage"],
+)
+AUDIO_DOWNLOADED_BYTES = Counter(
+    "jarvic_audio_downloaded_bytes_total",
+    "Audio bytes downloaded from audio links",
+)
+TRANSCRIPTION_UPLOAD_BYTES = Counter(
+    "jarvic_transcription_upload_bytes_total",
+    "Audio bytes uploaded to the transcription API",
+)
+AUDIO_STORE_REQUESTS = Counter(
+    "jarvic_audio_store_requests_total",
+    "Audio fetches through the on-disk store by result (not_modified/downloaded)",
+    ["result"],
+)
+AUDIO_STORE_BYTES = Gauge(
+    "jarvic_audio_store_bytes",
+    "Bytes of audio held in the on-disk store, as tracked by this worker",
+)
+OPENAI_TOKENS = Counter(
+    "jarvic_openai_tokens_total",
+    "Tokens reported in OpenAI usage, by model and kind (prompt/completion)",
+    ["model", "kind"],
+)
+DB_POOL_WAIT = Histogram(
+    "jarvic_db_pool_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+TRANSCRIPT_CACHE_REQUESTS = Counter(
+    "jarvic_transcript_cache_requests_total",
+    "Transcript cache lookups by result (hit/miss)",
+    ["result"],
+)
+PROMPT_TOKENS = Histogram(
+    "jarvic_prompt_tokens",
+    "Prompt tokens per summary/narrative request, counted locally before sending",
+    ["pipeline"],
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+COMPLETION_CACHE_REQUESTS = Counter(
+    "jarvic_completion_cache_requests_total",
+    "Summary/narrative completion lookups by result (hit/miss/coalesced)",
+    ["result"],
+)
+OPENAI_QUEUE_DEPTH = Gauge(
+    "jarvic_openai_queued_requests",
+    "Requests waiting for an OpenAI concurrency slot or rate budget",
+    ["model"],
+)
+OPENAI_IN_FLIGHT = Gauge(
+    "jarvic_openai_in_flight_requests",
+    "OpenAI requests currently running, streams included",
+    ["model"],
+)
+OPENAI_CONCURRENCY_LIMIT = Gauge(
+    "jarvic_openai_concurrency_limit",
+    "Current adaptive concurrency limit per model (halved on 429s and timeouts, raised on success)",
+    ["model"],
+)
+OPENAI_RETRIES = Counter(
+    "jarvic_openai_retries_total",
+    "Retried OpenAI calls by reason (rate_limit/server_error/timeout/connection)",
+    ["model", "reason"],
+)
+OPENAI_REJECTED = Counter(
+    "jarvic_openai_rejected_total",
+    "OpenAI calls refused with 503 by reason (queue_timeout/circuit_open)",
+    ["model", "reason"],
+)
+OPENAI_CIRCUIT_STATE = Gauge(
+    "jarvic_openai_circuit_state",
+    "Circuit breaker state per model (0 closed, 1 open, 2 half-open)",
+    ["model"],
+)
+WRITE_BEHIND_PENDING = Gauge(
+    "jarvic_write_behind_pending_rows",
+    "Processing records buffered in memory and the spill file, waiting to be written",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "jarvic_admission_queued_requests",
+    "Requests waiting for an admission slot, by route class (audio/narrative/auth/reads)",
+    ["route_class"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "jarvic_admission_in_flight_requests",
+    "Admitted requests still being handled, by route class",
+    ["route_class"],
+)
+ADMISSION_SHED = Counter(
+    "jarvic_admission_shed_total",
+    "Requests refused with 503 by route class and reason (queue_full/queue_timeout)",
+    ["route_class", "reason"],
+)
+EXPORT_ROWS = Counter(
+    "jarvic_export_rows_total",
+    "Rows written by bulk exports",
+    ["table"],
+)
+
+# Request profile collecting stage timings, set by app.profiling for profiled requests only
+active_profile: ContextVar[Optional[Any]] = ContextVar("active_profile", default=None)
+
+
+@contextmanager
+def track_stage(pipeline: str, stage: str, started: Optional[float] = None):
+    """Time a pipeline stage and count it as an error if it raises.
+
+    ``started`` (a perf_counter value) lets a stage that spans several
+    blocks, such as a streamed completion, be observed once from its start.
+    """
+    if started is None:
+        started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        STAGE_ERRORS.labels(pipeline, stage).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_LATENCY.labels(pipeline, stage).observe(duration)
+        profile = active_profile.get()
+        if profile is not None:
+            profile.add_stage(pipeline, stage, started, duration, failed)
+
+
+def record_usage(model: str, usage):
+    """Count the token usage block of an OpenAI response, if present"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels(model, "prompt").inc(usage.prompt_tokens or 0)
+    OPENAI_TOKENS.labels(model, "completion").inc(usage.completion_tokens or 0)
+
+
+def render_metrics():
+    """(body, content type) in the Prometheus text exposition format"""
+    return generate_latest(), CONTENT_TYPE_LATEST
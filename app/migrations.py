@@ -0,0 +1,243 @@
+import logging
+from typing import Callable, List, Optional, Sequence
+
+from mysql.connector import Error, errorcode
+
+from .config import get_settings
+from .database import db_connection
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Named lock (GET_LOCK) so only one worker applies migrations at a time
+SCHEMA_LOCK = "jarvic_schema_migrations"
+
+
+class MigrationError(Exception):
+    """Raised when the schema cannot be brought up to date"""
+
+
+class Migration:
+    """One schema change: ``statements`` run in order, then ``apply`` if given"""
+
+    def __init__(self, version: int, description: str, statements: Sequence[str] = (), apply: Optional[Callable] = None):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.apply = apply
+
+    def run(self, cursor):
+        for statement in self.statements:
+            cursor.execute(statement)
+        if self.apply is not None:
+            self.apply(cursor)
+
+
+def _column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def _add_entry_hashes(cursor):
+    # narrative_records created before incremental narratives has no entry_hashes
+    if not _column_exists(cursor, "narrative_records", "entry_hashes"):
+        cursor.execute("ALTER TABLE narrative_records ADD COLUMN entry_hashes TEXT AFTER status")
+
+
+def _index_exists(cursor, table: str, index: str) -> bool:
+    cursor.execute("""
+    SELECT COUNT(*) FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def _add_history_indexes(cursor):
+    # Covering indexes for the history list views: the filter columns, then id
+    # for keyset order, then the listed columns. Each one replaces the index
+    # that is its prefix.
+    changes = [
+        ("audio_processing_records", "idx_chat_user_history",
+         "(chat_id, user_id, id, process_id, status, processed_at, created_at)", "idx_chat_user"),
+        ("narrative_records", "idx_chat_user_history",
+         "(chat_id, user_id, id, visit_id, status, created_at)", "idx_chat_user"),
+        ("narrative_records", "idx_visit_history",
+         "(visit_id, id, chat_id, user_id, status, created_at)", "idx_visit"),
+    ]
+    for table, index, columns, replaces in changes:
+        if not _index_exists(cursor, table, index):
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} {columns}")
+        if _index_exists(cursor, table, replaces):
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {replaces}")
+
+
+def _add_export_indexes(cursor):
+    # Per-user created_at range scans for bulk exports, in export order
+    for table in ("audio_processing_records", "narrative_records"):
+        if not _index_exists(cursor, table, "idx_user_created"):
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX idx_user_created (user_id, created_at)")
+
+
+def _add_fulltext_indexes(cursor):
+    # The first FULLTEXT index rebuilds the table (InnoDB adds FTS_DOC_ID), one per statement
+    changes = [
+        ("audio_processing_records", "ft_transcript", "(audio_text, text_summary)"),
+        ("narrative_records", "ft_narrative", "(narrative)"),
+    ]
+    for table, index, columns in changes:
+        if not _index_exists(cursor, table, index):
+            cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {index} {columns}")
+
+
+def _add_job_leases(cursor):
+    # The worker running a job and until when; an expired lease means the worker died
+    changes = [
+        ("worker_id", "VARCHAR(64) AFTER status"),
+        ("leased_until", "DATETIME AFTER worker_id"),
+    ]
+    for column, definition in changes:
+        if not _column_exists(cursor, "audio_processing_jobs", column):
+            cursor.execute(f"ALTER TABLE audio_processing_jobs ADD COLUMN {column} {definition}")
+
+
+# Append new migrations at the end with the next version; never edit applied ones
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Create base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS audio_processing_records (
+            id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            process_id VARCHAR(10) NOT NULL,
+            chat_id VARCHAR(100) NOT NULL,
+            user_id VARCHAR(100) NOT NULL,
+            audio_link TEXT NOT NULL,
+            audio_text TEXT,
+            text_summary TEXT,
+            processed_at DATETIME NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_chat_user (chat_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS narrative_records (
+            id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            visit_id VARCHAR(100) NOT NULL,
+            chat_id VARCHAR(100) NOT NULL,
+            user_id VARCHAR(100) NOT NULL,
+            narrative TEXT,
+            status VARCHAR(50) NOT NULL,
+            entry_hashes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_visit (visit_id),
+            INDEX idx_chat_user (chat_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transcription_cache (
+            audio_sha256 CHAR(64) NOT NULL,
+            model VARCHAR(50) NOT NULL,
+            audio_text MEDIUMTEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (audio_sha256, model)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS audio_processing_jobs (
+            job_id CHAR(32) PRIMARY KEY,
+            username VARCHAR(100) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            result MEDIUMTEXT,
+            error TEXT,
+            attempts INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_status (status, created_at)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            username VARCHAR(100) PRIMARY KEY,
+            hashed_password VARCHAR(255) NOT NULL,
+            disabled BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    Migration(2, "Add narrative_records.entry_hashes to pre-existing tables", apply=_add_entry_hashes),
+    Migration(3, "Covering indexes for paginated history reads", apply=_add_history_indexes),
+    Migration(4, "User and created_at indexes for bulk exports", apply=_add_export_indexes),
+    Migration(5, "FULLTEXT indexes for transcript and narrative search", apply=_add_fulltext_indexes),
+    Migration(6, "Worker leases on running audio jobs", apply=_add_job_leases),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _schema_version(cursor) -> int:
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    except Error as e:
+        if e.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+        return 0
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def migrate() -> int:
+    """Apply pending migrations and return the schema version (blocking).
+
+    A current schema costs one SELECT. Otherwise the schema lock is taken,
+    the version re-read (another worker may have just migrated) and each
+    pending migration is applied and recorded in ``schema_migrations``.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            current = _schema_version(cursor)
+            if current >= LATEST_VERSION:
+                logger.info(f"Database schema is current (version {current})")
+                return current
+
+            cursor.execute("SELECT GET_LOCK(%s, %s)", (SCHEMA_LOCK, settings.DB_MIGRATION_LOCK_TIMEOUT))
+            if cursor.fetchone()[0] != 1:
+                raise MigrationError("Timed out waiting for the schema migration lock")
+
+            try:
+                cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """)
+                current = _schema_version(cursor)
+                for migration in MIGRATIONS:
+                    if migration.version <= current:
+                        continue
+                    logger.info(f"Applying schema migration {migration.version}: {migration.description}")
+                    migration.run(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (migration.version, migration.description)
+                    )
+                    conn.commit()
+                    current = migration.version
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+                cursor.fetchone()
+
+            logger.info(f"Database schema migrated to version {current}")
+            return current
+
+        except Error as e:
+            raise MigrationError(f"Schema migration failed: {str(e)}") from e
+
+        finally:
+            cursor.close()
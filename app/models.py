@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 class AudioProcessingInput(BaseModel):
@@ -27,4 +27,38 @@ class NarrativeOutput(BaseModel):
     chat_id: str
     user_id: str
     narrative: str
-    status: str
\ No newline at end of file
+    status: str
+
+class AudioJobSubmitted(BaseModel):
+    job_id: str
+    status: str
+
+class AudioJobStatus(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[AudioProcessingOutput] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class AudioBatchItemResult(BaseModel):
+    index: int
+    status: str
+    result: Optional[AudioProcessingOutput] = None
+    error: Optional[str] = None
+
+class AudioBatchOutput(BaseModel):
+    results: List[AudioBatchItemResult]
+
+class NarrativeBatchItemResult(BaseModel):
+    index: int
+    status: str
+    result: Optional[NarrativeOutput] = None
+    error: Optional[str] = None
+
+class NarrativeBatchOutput(BaseModel):
+    results: List[NarrativeBatchItemResult]
+
+class RecordPage(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None  # Pass as ``cursor`` for the next page; None on the last page
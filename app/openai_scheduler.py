@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import openai
+from fastapi import HTTPException, status
+
+from .config import get_settings
+from .metrics import (
+    OPENAI_CIRCUIT_STATE,
+    OPENAI_CONCURRENCY_LIMIT,
+    OPENAI_IN_FLIGHT,
+    OPENAI_QUEUE_DEPTH,
+    OPENAI_REJECTED,
+    OPENAI_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+# Seconds of a per-minute limit that may be spent in one burst
+_BURST_SECONDS = 10
+
+
+class TokenBucket:
+    """Refills at ``per_minute / 60`` units per second, holding at most ``_BURST_SECONDS`` worth"""
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * _BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self, amount: float):
+        amount = min(amount, self.capacity)
+        # The lock keeps waiters in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveSlots:
+    """Concurrency slots whose limit adapts AIMD-style between ``minimum`` and ``maximum``.
+
+    The limit grows by one after a full limit's worth of successes and is
+    halved on overload, at most once per ``cooldown`` seconds so a burst of
+    429s from the same moment counts once. A released slot is handed
+    straight to the next waiter, and a waiter that times out or is
+    cancelled after being handed one gives it back, so no slot is lost the
+    way ``wait_for(semaphore.acquire())`` can lose one on Python < 3.12.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = max(1, min(minimum, maximum))
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._decreased_at = 0.0
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to ``timeout`` seconds; False if none came free in time"""
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # Unlike wait_for, wait never cancels the waiter, so a slot handed over meanwhile is seen below
+            await asyncio.wait({waiter}, timeout=timeout)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if waiter.done():
+            return True
+        self._abandon(waiter)
+        return False
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done():
+            # Handed a slot just as we stopped waiting
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def increase(self):
+        if self.limit < self.maximum:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._wake()
+
+    def decrease(self, cooldown: float) -> bool:
+        """Halve the limit; slots over it drain as they are released. False if still cooling down"""
+        now = time.monotonic()
+        if self.limit <= self.minimum or now - self._decreased_at < cooldown:
+            return False
+        self._decreased_at = now
+        self.limit = max(float(self.minimum), self.limit / 2)
+        return True
+
+
+class ModelLimiter:
+    """Adaptive concurrency slots, rate buckets and circuit breaker for one model"""
+
+    def __init__(self, model: str, concurrency: int, rpm: Optional[int], tpm: Optional[int]):
+        self.model = model
+        self.slots = AdaptiveSlots(concurrency, settings.OPENAI_MIN_CONCURRENCY)
+        OPENAI_CONCURRENCY_LIMIT.labels(model).set(concurrency)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.queued = 0
+        self.latency = 1.0  # Moving average of call duration, for Retry-After estimates
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def retry_after(self) -> int:
+        if self.state == OPEN:
+            return max(1, math.ceil(self.opened_at + settings.OPENAI_CIRCUIT_RESET - time.monotonic()))
+        return max(1, math.ceil(self.latency * (self.queued + 1) / int(self.slots.limit)))
+
+    def _set_state(self, state: int):
+        self.state = state
+        OPENAI_CIRCUIT_STATE.labels(self.model).set(state)
+
+    def check_circuit(self):
+        """Fail fast while the circuit is open; let a single probe through once it may have recovered"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= settings.OPENAI_CIRCUIT_RESET:
+            self._set_state(HALF_OPEN)
+            self.probing = False
+        if self.state == OPEN or (self.state == HALF_OPEN and self.probing):
+            OPENAI_REJECTED.labels(self.model, "circuit_open").inc()
+            raise unavailable(f"OpenAI {self.model} is unavailable, try again later", self.retry_after())
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def record_success(self, duration: float):
+        self.latency = 0.8 * self.latency + 0.2 * duration
+        self.failures = 0
+        self.slots.increase()
+        OPENAI_CONCURRENCY_LIMIT.labels(self.model).set(int(self.slots.limit))
+        if self.state != CLOSED:
+            logger.info(f"OpenAI circuit for {self.model} closed")
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= settings.OPENAI_CIRCUIT_FAILURES:
+            if self.state != OPEN:
+                logger.warning(f"OpenAI circuit for {self.model} opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def record_overload(self):
+        """A 429 or timeout: back off the concurrency limit, at most once per average call duration"""
+        if self.slots.decrease(self.latency):
+            limit = int(self.slots.limit)
+            OPENAI_CONCURRENCY_LIMIT.labels(self.model).set(limit)
+            logger.warning(f"OpenAI {self.model} is overloaded, concurrency limit lowered to {limit}")
+
+    def release_probe(self):
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    async def acquire(self, tokens: int):
+        """Wait for a slot and rate budget, up to OPENAI_QUEUE_TIMEOUT seconds in total"""
+        deadline = time.monotonic() + settings.OPENAI_QUEUE_TIMEOUT
+        self.queued += 1
+        OPENAI_QUEUE_DEPTH.labels(self.model).inc()
+        try:
+            if not await self.slots.acquire(settings.OPENAI_QUEUE_TIMEOUT):
+                raise self._queue_timeout()
+            try:
+                if self.requests is not None:
+                    await asyncio.wait_for(self.requests.take(1), max(0.0, deadline - time.monotonic()))
+                if self.tokens is not None and tokens:
+                    await asyncio.wait_for(self.tokens.take(tokens), max(0.0, deadline - time.monotonic()))
+            except BaseException as e:
+                self.slots.release()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._queue_timeout()
+                raise
+        finally:
+            self.queued -= 1
+            OPENAI_QUEUE_DEPTH.labels(self.model).dec()
+        OPENAI_IN_FLIGHT.labels(self.model).inc()
+
+    def release(self):
+        OPENAI_IN_FLIGHT.labels(self.model).dec()
+        self.slots.release()
+
+    def _queue_timeout(self) -> HTTPException:
+        OPENAI_REJECTED.labels(self.model, "queue_timeout").inc()
+        logger.warning(f"Timed out queueing for OpenAI {self.model} ({self.queued} waiting)")
+        return unavailable(f"Too many pending OpenAI {self.model} requests, try again later", self.retry_after())
+
+
+def unavailable(detail: str, retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    """Why ``error`` is worth retrying, or None if it is not"""
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code in (408, 409)):
+        return "server_error"
+    return None
+
+
+def _server_retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                return None
+    return None
+
+
+class _HeldStream:
+    """Iterates a streaming response while holding its concurrency slot.
+
+    The slot is freed as soon as the stream ends or fails. Callers must
+    still ``aclose()`` it (or use ``async with``) in a finally, iterated or
+    not: that frees the slot of a stream abandoned midway and closes the
+    HTTP response.
+    """
+
+    def __init__(self, stream, limiter: ModelLimiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._stream.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        self._release()
+        close = getattr(self._stream, "aclose", None)
+        if close is not None:
+            await close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class OpenAIScheduler:
+    """Shared gate in front of every OpenAI call.
+
+    Each model gets its own adaptive concurrency limit, starting at and
+    never above OPENAI_MODEL_CONCURRENCY, halved on 429s and timeouts and
+    raised again as calls succeed (AIMD), requests-per-minute and tokens-per-minute buckets (OPENAI_MODEL_RPM /
+    OPENAI_MODEL_TPM) and circuit breaker. Callers beyond the limits queue
+    for up to OPENAI_QUEUE_TIMEOUT seconds; rate limits, timeouts and 5xx
+    responses are retried with jittered exponential backoff. Queue
+    timeouts and an open circuit are raised as 503 with Retry-After.
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        # Created on first use so the asyncio primitives bind to the running loop
+        if model not in self._limiters:
+            self._limiters[model] = ModelLimiter(
+                model,
+                settings.OPENAI_MODEL_CONCURRENCY.get(model, settings.OPENAI_DEFAULT_CONCURRENCY),
+                settings.OPENAI_MODEL_RPM.get(model),
+                settings.OPENAI_MODEL_TPM.get(model),
+            )
+        return self._limiters[model]
+
+    async def _run(self, model: str, make_request: Callable[[], Awaitable[T]], tokens: int) -> Tuple[T, ModelLimiter]:
+        """Call ``make_request`` until it succeeds; returns the result with its slot still held"""
+        limiter = self.limiter(model)
+        attempt = 0
+        while True:
+            limiter.check_circuit()
+            try:
+                await limiter.acquire(tokens)
+            except BaseException:
+                limiter.release_probe()
+                raise
+
+            started = time.monotonic()
+            try:
+                result = await make_request()
+            except Exception as e:
+                limiter.release()
+                reason = _retry_reason(e)
+                if reason is None:
+                    limiter.release_probe()
+                    raise
+                if reason in ("rate_limit", "timeout"):
+                    limiter.record_overload()
+                if reason != "rate_limit":
+                    limiter.record_failure()
+                else:
+                    limiter.release_probe()
+                if attempt >= settings.OPENAI_MAX_RETRIES or limiter.state == OPEN:
+                    raise
+                delay = random.uniform(0, min(settings.OPENAI_RETRY_MAX_DELAY, settings.OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+                delay = max(delay, min(_server_retry_after(e) or 0.0, settings.OPENAI_RETRY_MAX_DELAY))
+                attempt += 1
+                OPENAI_RETRIES.labels(model, reason).inc()
+                logger.warning(f"OpenAI {model} call failed ({reason}), retry {attempt} in {delay:.2f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                limiter.release()
+                limiter.release_probe()
+                raise
+
+            limiter.record_success(time.monotonic() - started)
+            return result, limiter
+
+    async def call(self, model: str, make_request: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """Run ``make_request()`` under ``model``'s limits with retries.
+
+        ``make_request`` is called again for every attempt, so it must build
+        the request from scratch (e.g. rewind upload files). ``tokens`` is
+        the estimated prompt size charged to the tokens-per-minute bucket.
+        """
+        result, limiter = await self._run(model, make_request, tokens)
+        limiter.release()
+        return result
+
+    async def stream(self, model: str, make_request: Callable[[], Awaitable[AsyncIterator[T]]], tokens: int = 0) -> AsyncIterator[T]:
+        """Like ``call`` for streaming responses; the slot is held until the stream ends or is closed with ``aclose()``"""
+        stream, limiter = await self._run(model, make_request, tokens)
+        return _HeldStream(stream, limiter)
+
+
+openai_scheduler = OpenAIScheduler()
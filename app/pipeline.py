@@ -0,0 +1,552 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+from openai import AsyncOpenAI
+
+from .completion_cache import completion_cache
+from .config import get_settings
+from .database import get_latest_narrative
+from .audio_preprocessing import prepare_audio, transcribe_segments
+from .audio_store import fetch_audio
+from .downloads import AudioTooLargeError, DownloadedAudio
+from .metrics import PROMPT_TOKENS, TRANSCRIPTION_UPLOAD_BYTES, record_usage, track_stage
+from .openai_scheduler import openai_scheduler
+from .models import (
+    AudioProcessingInput,
+    AudioProcessingOutput,
+    NarrativeInput,
+    NarrativeOutput
+)
+from .prompts import (
+    FittedInput,
+    count_message_tokens,
+    count_tokens,
+    fit_to_budget,
+    incremental_narrative_messages,
+    narrative_messages,
+    summary_messages
+)
+from .transcript_cache import hash_file, transcript_cache
+from .write_behind import AUDIO, NARRATIVE, persist_records, write_behind
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Shared clients, created on first use so importing the app stays cheap
+_openai_client: Optional[AsyncOpenAI] = None
+_http_client: Optional[httpx.AsyncClient] = None
+
+TRANSCRIPTION_MODEL = "whisper-1"
+SUMMARY_MODEL = "gpt-4o-mini"
+NARRATIVE_MODEL = "gpt-4o-mini"
+
+# Fallback audio file if link is invalid
+DEFAULT_AUDIO_PATH = "/app/audio.mp3"
+
+
+def openai_client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        # Retries are done by openai_scheduler, which also enforces per-model limits
+        _openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+    return _openai_client
+
+
+def http_client() -> httpx.AsyncClient:
+    """Shared async HTTP client so audio downloads reuse connections and never block the event loop"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=10.0, follow_redirects=True)
+    return _http_client
+
+
+async def close_clients():
+    """Release the shared OpenAI and HTTP clients, if they were created"""
+    global _openai_client, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+
+
+def audio_record(input: AudioProcessingInput, output: AudioProcessingOutput) -> tuple:
+    """Row for audio_processing_records"""
+    return (
+        output.process_id,
+        input.chat_id,
+        input.user_id,
+        output.audio_link,
+        output.audio_text,
+        output.text_summary,
+        datetime.utcnow(),
+        output.status
+    )
+
+
+def narrative_record(output: NarrativeOutput, entry_hashes: List[str]) -> tuple:
+    """Row for narrative_records"""
+    return (
+        output.visit_id,
+        output.chat_id,
+        output.user_id,
+        output.narrative,
+        output.status,
+        json.dumps(entry_hashes)
+    )
+
+
+async def complete(model: str, messages: List[dict]) -> str:
+    """Text of a chat completion, shared with identical recent or in-flight requests"""
+    async def request() -> str:
+        completion = await openai_scheduler.call(
+            model,
+            lambda: openai_client().chat.completions.create(
+                model=model,
+                messages=messages
+            ),
+            count_message_tokens(messages, model)
+        )
+        record_usage(model, completion.usage)
+        return completion.choices[0].message.content
+
+    return await completion_cache.get_or_create(completion_cache.key(model, messages), request)
+
+
+def report_prompt(pipeline: str, model: str, messages: List[dict], fitted: FittedInput):
+    """Log and record the token count of a prompt built from a fitted input"""
+    tokens = count_message_tokens(messages, model)
+    PROMPT_TOKENS.labels(pipeline).observe(tokens)
+    logger.info(f"{pipeline.capitalize()} prompt: {fitted.describe()}, {tokens} prompt tokens")
+
+
+async def condense(messages: List[dict]) -> str:
+    """Shorten one chunk of an over-budget input (hierarchical summarization)"""
+    return await complete(SUMMARY_MODEL, messages)
+
+
+class CompletionDeltas:
+    """Text deltas of a streamed (or replayed) completion.
+
+    ``aclose()`` must be called once the caller is done, in a finally: it
+    frees the OpenAI slot and closes the response even if the deltas were
+    never iterated, e.g. when the client went away before the body started.
+    """
+
+    def __init__(self, deltas: AsyncIterator[str], stream=None):
+        self._deltas = deltas
+        self._stream = stream
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        return await self._deltas.__anext__()
+
+    async def aclose(self):
+        try:
+            await self._deltas.aclose()
+        finally:
+            if self._stream is not None:
+                await self._stream.aclose()
+
+
+async def stream_completion(model: str, messages: List[dict], pipeline: str, stage: str) -> CompletionDeltas:
+    """Open a streaming chat completion and return its text deltas.
+
+    The request is sent before this coroutine returns, so connection and API
+    errors surface to the caller rather than mid-stream. ``<stage>_first_byte``
+    times the request up to the response headers; ``stage`` is observed once
+    the last delta has been consumed. A cached completion for the same
+    prompt is replayed as a single delta, and a fully streamed one is cached.
+    """
+    key = completion_cache.key(model, messages)
+    cached = completion_cache.get(key)
+    if cached is not None:
+        async def replay():
+            yield cached
+
+        return CompletionDeltas(replay())
+
+    started = time.perf_counter()
+    with track_stage(pipeline, f"{stage}_first_byte"):
+        stream = await openai_scheduler.stream(
+            model,
+            lambda: openai_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            ),
+            count_message_tokens(messages, model)
+        )
+
+    async def deltas():
+        parts: List[str] = []
+        with track_stage(pipeline, stage, started):
+            async for chunk in stream:
+                record_usage(model, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        completion_cache.put(key, "".join(parts))
+
+    return CompletionDeltas(deltas(), stream)
+
+
+async def transcribe_file(path: Path) -> str:
+    TRANSCRIPTION_UPLOAD_BYTES.inc(path.stat().st_size)
+
+    async def request():
+        with open(path, "rb") as audio_file:
+            return await openai_client().audio.transcriptions.create(
+                model=TRANSCRIPTION_MODEL,
+                file=audio_file
+            )
+
+    transcription = await openai_scheduler.call(TRANSCRIPTION_MODEL, request)
+    return transcription.text
+
+
+async def transcribe_original(downloaded_audio: Optional[DownloadedAudio]) -> str:
+    """Upload the audio exactly as downloaded (or the fallback file)"""
+    if downloaded_audio is not None:
+        logger.info(f"Starting audio transcription of {downloaded_audio.size} downloaded bytes")
+        TRANSCRIPTION_UPLOAD_BYTES.inc(downloaded_audio.size)
+        transcription = await openai_scheduler.call(
+            TRANSCRIPTION_MODEL,
+            lambda: openai_client().audio.transcriptions.create(
+                model=TRANSCRIPTION_MODEL,
+                file=downloaded_audio.upload_file()
+            )
+        )
+        return transcription.text
+
+    logger.info(f"Starting audio transcription using file: {DEFAULT_AUDIO_PATH}")
+    return await transcribe_file(Path(DEFAULT_AUDIO_PATH))
+
+
+async def transcribe_audio(input: AudioProcessingInput) -> Tuple[str, str]:
+    """Download and transcribe the recording behind ``input.audio_link``.
+
+    Returns ``(transcript_text, audio_link)`` where ``audio_link`` is the
+    value stored with the record ("default_audio" when the fallback file was
+    used). Failures are raised as HTTPException.
+    """
+    downloaded_audio = None
+
+    try:
+        # Attempt to fetch the audio file through the on-disk store (revalidated, not re-downloaded)
+        try:
+            logger.info(f"Attempting to download audio from: {input.audio_link}")
+            with track_stage("audio", "download"):
+                downloaded_audio = await fetch_audio(http_client(), input.audio_link)
+            logger.info("Audio file downloaded successfully")
+
+        except AudioTooLargeError as e:
+            logger.warning(f"Rejected audio download: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=str(e)
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to download audio: {str(e)}")
+            if os.path.exists(DEFAULT_AUDIO_PATH):
+                logger.info(f"Using default audio.mp3 as fallback: {DEFAULT_AUDIO_PATH}")
+            else:
+                logger.error(f"Default audio file not found: {DEFAULT_AUDIO_PATH}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Both download and fallback audio file unavailable"
+                )
+
+        # Transcribe audio file, unless this exact audio was transcribed before
+        try:
+            if downloaded_audio is not None:
+                audio_hash = downloaded_audio.sha256
+            else:
+                audio_hash = await run_in_threadpool(hash_file, DEFAULT_AUDIO_PATH)
+            transcript_text = await transcript_cache.get(audio_hash, TRANSCRIPTION_MODEL)
+
+            if not transcript_text:
+                # Downsample, trim and split before uploading; falls back to the original file
+                with track_stage("audio", "preprocess"):
+                    source = downloaded_audio.fileno() if downloaded_audio is not None else DEFAULT_AUDIO_PATH
+                    prepared = await prepare_audio(source)
+
+                with track_stage("audio", "transcription"):
+                    if prepared is not None:
+                        try:
+                            logger.info(f"Starting transcription of {len(prepared.segments)} preprocessed segment(s)")
+                            transcript_text = await transcribe_segments(prepared, transcribe_file)
+                        finally:
+                            prepared.cleanup()
+                    else:
+                        transcript_text = await transcribe_original(downloaded_audio)
+                if transcript_text.strip():
+                    await transcript_cache.put(audio_hash, TRANSCRIPTION_MODEL, transcript_text)
+                else:
+                    # Not cached, so a later request transcribes this audio again
+                    logger.warning(f"Empty transcript for audio {audio_hash}, not caching it")
+                logger.info("Audio transcription completed successfully")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error("Error during transcription", exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Transcription failed: {str(e)}"
+            )
+
+        audio_link = input.audio_link if downloaded_audio is not None else "default_audio"
+        return transcript_text, audio_link
+
+    finally:
+        # Close this request's audio file; stored copies stay for the next request
+        if downloaded_audio is not None:
+            try:
+                downloaded_audio.close()
+                logger.info("Closed downloaded audio file")
+            except Exception as e:
+                logger.warning(f"Failed to close downloaded audio file: {str(e)}")
+
+
+async def summary_prompt(transcript_text: str) -> List[dict]:
+    """Summary prompt for a transcript, condensed first if it is over the input token budget"""
+    with track_stage("audio", "prompt"):
+        fitted = await fit_to_budget([transcript_text], SUMMARY_MODEL, condense)
+    messages = summary_messages(fitted.text)
+    report_prompt("audio", SUMMARY_MODEL, messages, fitted)
+    return messages
+
+
+async def summarize_transcript(transcript_text: str) -> str:
+    try:
+        messages = await summary_prompt(transcript_text)
+        logger.info("Generating summary using GPT-4")
+        with track_stage("audio", "summary"):
+            summary = await complete(SUMMARY_MODEL, messages)
+        logger.info("Summary generation completed")
+        return summary
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error generating summary", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Summary generation failed: {str(e)}"
+        )
+
+
+def build_audio_output(input: AudioProcessingInput, audio_link: str, transcript_text: str, summary: str) -> AudioProcessingOutput:
+    return AudioProcessingOutput(
+        process_id=f"{input.chat_id}{input.user_id}"[-5:],
+        audio_link=audio_link,
+        audio_text=transcript_text,
+        text_summary=summary,
+        processed_at=datetime.utcnow().isoformat() + "Z",
+        status="completed"
+    )
+
+
+async def save_audio_output(input: AudioProcessingInput, output: AudioProcessingOutput):
+    try:
+        logger.info(f"Saving audio processing record to database for process_id: {output.process_id}")
+        with track_stage("audio", "db_insert"):
+            await persist_records(AUDIO, [audio_record(input, output)])
+        logger.info("Database record saved successfully")
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+
+async def run_audio_pipeline(input: AudioProcessingInput, persist: bool = True) -> AudioProcessingOutput:
+    """Download, transcribe, summarize and store one audio recording.
+
+    Shared by the /process_audio/ handler, the batch endpoint and the
+    background job workers; failures are raised as HTTPException. With
+    ``persist=False`` the database insert is left to the caller.
+    """
+    try:
+        transcript_text, audio_link = await transcribe_audio(input)
+        summary = await summarize_transcript(transcript_text)
+        output = build_audio_output(input, audio_link, transcript_text, summary)
+
+        if persist:
+            await save_audio_output(input, output)
+        return output
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+async def combine_entries(entries: List[str], budget: Optional[int] = None) -> FittedInput:
+    """Deduplicated entries joined into one input that fits the token budget"""
+    with track_stage("narrative", "prompt"):
+        fitted = await fit_to_budget(entries, NARRATIVE_MODEL, condense, budget)
+    logger.debug(f"Combined input entries: {fitted.text[:200]}...")  # Log first 200 chars
+    return fitted
+
+
+def entry_hashes(entries: List[str]) -> List[str]:
+    return [hashlib.sha256(entry.encode("utf-8")).hexdigest() for entry in entries]
+
+
+class NarrativePlan:
+    """What to send to the model for a narrative request.
+
+    ``messages`` is None when the stored ``narrative`` already covers every
+    entry; ``entry_hashes`` are stored with the new narrative record.
+    """
+
+    def __init__(self, messages: Optional[List[dict]], entry_hashes: List[str], narrative: Optional[str] = None):
+        self.messages = messages
+        self.entry_hashes = entry_hashes
+        self.narrative = narrative
+
+
+async def _full_narrative_plan(input: NarrativeInput, hashes: List[str]) -> NarrativePlan:
+    fitted = await combine_entries(input.entries)
+    messages = narrative_messages(fitted.text)
+    report_prompt("narrative", NARRATIVE_MODEL, messages, fitted)
+    return NarrativePlan(messages, hashes)
+
+
+async def plan_narrative(input: NarrativeInput, incremental: bool = False) -> NarrativePlan:
+    """Build the narrative prompt, sending only new entries in incremental mode.
+
+    Incremental mode loads the latest stored narrative for the visit and
+    compares entry hashes: only entries it has not seen are sent together
+    with the previous narrative, and when there are none the stored
+    narrative is reused without calling the model.
+
+    The lookup only sees this worker's write-behind buffer and the
+    database, so a narrative still buffered by another worker is missed
+    and an older one is extended instead. That base is only used when
+    every entry it covers is part of this request; otherwise the
+    narrative is rebuilt in full.
+    """
+    hashes = entry_hashes(input.entries)
+    if not incremental:
+        return await _full_narrative_plan(input, hashes)
+
+    try:
+        with track_stage("narrative", "history_lookup"):
+            # Narratives still in the write-behind buffer are newer than anything stored
+            previous = write_behind.latest_narrative(input.visit_id, input.user_id)
+            if previous is None:
+                previous = await run_in_threadpool(get_latest_narrative, input.visit_id, input.user_id)
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database error")
+
+    if previous is None or not previous["entry_hashes"]:
+        logger.info(f"No stored narrative to extend for visit_id: {input.visit_id}")
+        return await _full_narrative_plan(input, hashes)
+
+    known = json.loads(previous["entry_hashes"])
+    known_set = set(known)
+    if not known_set.issubset(hashes):
+        # The stored narrative covers entries this request no longer has
+        logger.info(f"Stored narrative for visit_id: {input.visit_id} does not match the entries, rebuilding")
+        return await _full_narrative_plan(input, hashes)
+    new_entries = [entry for entry, digest in zip(input.entries, hashes) if digest not in known_set]
+    if not new_entries:
+        logger.info(f"No new entries for visit_id: {input.visit_id}, reusing stored narrative")
+        return NarrativePlan(None, known, narrative=previous["narrative"])
+
+    logger.info(f"Incremental narrative for visit_id: {input.visit_id} with {len(new_entries)} new of {len(input.entries)} entries")
+    all_hashes = known + [digest for digest in dict.fromkeys(hashes) if digest not in known_set]
+    # The previous narrative is sent as-is, so the new entries get what is left of the budget
+    budget = max(
+        settings.PROMPT_CHUNK_TOKENS,
+        settings.PROMPT_INPUT_TOKEN_BUDGET - count_tokens(previous["narrative"], NARRATIVE_MODEL)
+    )
+    fitted = await combine_entries(new_entries, budget)
+    messages = incremental_narrative_messages(previous["narrative"], fitted.text)
+    report_prompt("narrative", NARRATIVE_MODEL, messages, fitted)
+    return NarrativePlan(messages, all_hashes)
+
+
+async def generate_narrative(messages: List[dict]) -> str:
+    try:
+        logger.info("Generating narrative using GPT-4")
+        with track_stage("narrative", "generation"):
+            narrative = await complete(NARRATIVE_MODEL, messages)
+        logger.info("Narrative generation completed")
+        logger.debug(f"Generated narrative: {narrative[:200]}...")  # Log first 200 chars
+        return narrative
+    except HTTPException:
+        raise
+    except Exception:
+        logger.error("Error generating narrative", exc_info=True)
+        raise HTTPException(status_code=500, detail="Narrative generation failed")
+
+
+def build_narrative_output(input: NarrativeInput, narrative: str) -> NarrativeOutput:
+    return NarrativeOutput(
+        visit_id=input.visit_id,
+        chat_id=input.chat_id,
+        user_id=input.user_id,
+        narrative=narrative,
+        status="success"
+    )
+
+
+async def save_narrative_output(output: NarrativeOutput, entry_hashes: List[str]):
+    try:
+        logger.info(f"Saving narrative record to database for visit_id: {output.visit_id}")
+        with track_stage("narrative", "db_insert"):
+            await persist_records(NARRATIVE, [narrative_record(output, entry_hashes)])
+        logger.info("Database record saved successfully")
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database error")
+
+
+async def run_narrative_pipeline(input: NarrativeInput, persist: bool = True, incremental: bool = False) -> NarrativeOutput:
+    """Combine narrative entries with gpt-4o-mini and store the result.
+
+    With ``persist=False`` the database insert is left to the caller. See
+    plan_narrative for ``incremental``.
+    """
+    try:
+        plan = await plan_narrative(input, incremental)
+        if plan.messages is None:
+            return build_narrative_output(input, plan.narrative)
+
+        narrative = await generate_narrative(plan.messages)
+        output = build_narrative_output(input, narrative)
+
+        if persist:
+            await save_narrative_output(output, plan.entry_hashes)
+
+        logger.info(f"Narrative combination completed successfully for visit_id: {input.visit_id}")
+        return output
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in combine_narrative: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+from .auth.models import User
+from .auth.utils import get_current_active_user, get_current_user
+from .config import get_settings
+from .logging_config import request_id_var
+from .metrics import active_profile
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+PROFILE_HEADER = b"x-profile"
+_TRUE = ("1", "true", "yes")
+_PROFILE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Stacks and functions kept in a stored profile, most sampled first
+_MAX_STACKS = 200
+_MAX_FUNCTIONS = 50
+
+
+class RequestProfile:
+    """Wall-clock stages and sampled event loop stacks of one request.
+
+    A sampler thread reads the event loop thread's stack every
+    PROFILE_SAMPLE_INTERVAL seconds and keeps the sample only while one of
+    this request's tasks is running, so concurrent requests do not leak in.
+    Work this request hands to the threadpool (database calls, ffmpeg) is
+    not sampled; it shows up in the stage breakdown instead.
+    """
+
+    def __init__(self, profile_id: str, method: str, path: str, username: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.username = username
+        self.created_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.status_code: Optional[int] = None
+        self.wall_seconds = 0.0
+        self.stages: List[dict] = []
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.other_samples = 0
+        self.idle_samples = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_stage(self, pipeline: str, stage: str, started: float, duration: float, failed: bool):
+        # Called from track_stage, in threadpool threads too; list.append is atomic
+        self.stages.append({
+            "pipeline": pipeline,
+            "stage": stage,
+            "offset_seconds": round(started - self.started, 6),
+            "seconds": round(duration, 6),
+            "error": failed,
+        })
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.tasks.add(asyncio.current_task())
+        self._thread = threading.Thread(
+            target=self._sample, args=(loop, threading.get_ident()), name=f"profiler-{self.id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self.started
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self, loop: asyncio.AbstractEventLoop, loop_thread: int):
+        while not self._stopped.wait(settings.PROFILE_SAMPLE_INTERVAL):
+            task = asyncio.current_task(loop)
+            if task is None:
+                self.idle_samples += 1
+                continue
+            if task not in self.tasks:
+                self.other_samples += 1
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.samples += 1
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def report(self) -> dict:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            functions = [entry.rsplit(":", 1)[0] for entry in stack.split(";")]
+            self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "user": self.username,
+            "status_code": self.status_code,
+            "created_at": self.created_at.isoformat() + "Z",
+            "wall_seconds": round(self.wall_seconds, 6),
+            "stages": sorted(self.stages, key=lambda stage: stage["offset_seconds"]),
+            "sampling": {
+                "interval_seconds": settings.PROFILE_SAMPLE_INTERVAL,
+                "samples": self.samples,
+                "other_request_samples": self.other_samples,
+                "idle_samples": self.idle_samples,
+            },
+            # Where the samples landed; the event loop and framework frames are in every stack
+            "top_functions": [
+                {"function": function, "self_samples": self_counts[function], "total_samples": total_counts[function]}
+                for function in sorted(
+                    total_counts, key=lambda function: (self_counts[function], total_counts[function]), reverse=True
+                )[:_MAX_FUNCTIONS]
+            ],
+            # Folded stacks ("root;...;leaf count"), e.g. for flamegraph.pl or speedscope
+            "stacks": [f"{stack} {count}" for stack, count in self.stacks.most_common(_MAX_STACKS)],
+        }
+
+
+class _TaskTracker:
+    """Task factory, installed only while a profile runs, that adds tasks spawned by a profiled request to it"""
+
+    def __init__(self):
+        self.active = 0
+        self._previous = None
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        if self.active == 0:
+            self._previous = loop.get_task_factory()
+            loop.set_task_factory(self._factory)
+        self.active += 1
+
+    def uninstall(self, loop: asyncio.AbstractEventLoop):
+        self.active -= 1
+        if self.active == 0:
+            loop.set_task_factory(self._previous)
+            self._previous = None
+
+    def _factory(self, loop, coro, **kwargs):
+        if self._previous is not None:
+            task = self._previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # Runs in the creating task's context
+        profile = active_profile.get()
+        if profile is not None:
+            profile.tasks.add(task)
+        return task
+
+
+_task_tracker = _TaskTracker()
+
+
+def _requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value.decode("latin-1").lower() in _TRUE
+    query = scope.get("query_string", b"")
+    if b"profile=" in query:
+        values = parse_qs(query.decode("latin-1")).get("profile", [])
+        return bool(values) and values[-1].lower() in _TRUE
+    return False
+
+
+async def _profiling_user(scope) -> Optional[str]:
+    """Username if the request carries a valid token of a profiling admin"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                user = await get_current_user(token)
+            except HTTPException:
+                return None
+            if user.disabled or user.username not in settings.PROFILING_ADMINS:
+                return None
+            return user.username
+    return None
+
+
+def _profile_path(profile_id: str) -> Path:
+    return Path(settings.PROFILE_DIR) / f"{profile_id}.json"
+
+
+def save_profile(report: dict):
+    """Write a profile to PROFILE_DIR and drop the oldest beyond PROFILE_KEEP (blocking)"""
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = _profile_path(report["id"])
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    tmp_path.replace(path)
+
+    profiles = sorted(directory.glob("*.json"), key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-settings.PROFILE_KEEP]:
+        entry.unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict[str, object]]:
+    """Stored profiles, newest first (blocking)"""
+    directory = Path(settings.PROFILE_DIR)
+    if not directory.exists():
+        return []
+    profiles = sorted(directory.glob("*.json"), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    summaries = []
+    for entry in profiles:
+        try:
+            with open(entry, encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summaries.append({key: report.get(key) for key in ("id", "method", "path", "user", "status_code", "created_at", "wall_seconds")})
+    return summaries
+
+
+def load_profile(profile_id: str) -> Optional[dict]:
+    """A stored profile by id, or None (blocking)"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(_profile_path(profile_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def get_profiling_admin(current_user: User = Depends(get_current_active_user)) -> User:
+    if current_user.username not in settings.PROFILING_ADMINS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling is restricted to administrators")
+    return current_user
+
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it with ``X-Profile: 1`` or ``?profile=1``.
+
+    Only tokens of users in PROFILING_ADMINS turn profiling on; anyone
+    else's request runs unprofiled. The profile is written to PROFILE_DIR
+    and its id returned in ``X-Profile-Id`` for GET /debug/profiles/{id}.
+    The middleware is only installed when PROFILING_ADMINS is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        username = await _profiling_user(scope)
+        if username is None:
+            logger.warning(f"Ignoring profile request for {scope['path']} without a profiling admin token")
+            await self.app(scope, receive, send)
+            return
+
+        request_id = request_id_var.get()
+        profile_id = request_id if _PROFILE_ID.match(request_id) else uuid.uuid4().hex
+        profile = RequestProfile(profile_id, scope["method"], scope["path"], username)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        loop = asyncio.get_running_loop()
+        token = active_profile.set(profile)
+        _task_tracker.install(loop)
+        profile.start(loop)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _task_tracker.uninstall(loop)
+            active_profile.reset(token)
+            await run_in_threadpool(profile.stop)
+            try:
+                await run_in_threadpool(save_profile, profile.report())
+                logger.info(f"Profiled {scope['method']} {scope['path']} for {username}: {profile.wall_seconds:.3f}s, {profile.samples} samples")
+            except OSError as e:
+                logger.error(f"Failed to store profile {profile_id}: {str(e)}")
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import re
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
+
+from .config import get_settings
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Fallback when no tokenizer is available; errs on the high side for English
+_CHARS_PER_TOKEN = 3.5
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_NON_WORD = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+(?:[.,/:]\d+)*")
+_WORD_OR_CONTRACTION = re.compile(r"[a-z]+(?:n't)?")
+# Words that flip a finding; near-duplicates must agree on these exactly
+_NEGATIONS = frozenset({
+    "no", "not", "non", "none", "nor", "never", "without", "absent", "negative",
+    "deny", "denies", "denied", "cannot", "unable",
+})
+
+
+def summary_messages(transcript_text: str) -> List[dict]:
+    return [
+        {"role": "system",
+        "content": f"""
+                    You are an assistant specialized in analyzing audio transcriptions from nurses and generating concise, well-structured patient health reports.
+                    Input:
+                    You will receive a transcription summarizing the patient’s current health status.
+
+                    Expected Output:
+                    1. A clear and organized summary of the patient’s health report, emphasizing key details.
+                    2. Use natural language, ensuring all important details are included.
+                    3. Do not assume any information that is not explicitly provided in the transcription.
+                    4. Do not use any symbols like \n\n(slash n), **, etc. Just normal paragraph. Directly start with the summary. Do not use anything like "Summary:" or "Patient's Health Report:".
+                    Transcription Provided:
+                    {transcript_text}
+
+                    Example Output:
+                    The patient, Jane Smith, aged 54, was admitted on December 10th for severe headaches and dizziness. Initial vitals included a blood pressure of 140/90 and a heart rate of 85 bpm. A CT scan indicated mild cerebral edema. By December 11th, the headache intensity had reduced, though dizziness persisted. Continued NSAID treatment and physical therapy were recommended. Discharge is tentatively planned for December 15th, pending results.
+                    """},
+    ]
+
+
+def narrative_messages(combined_input: str) -> List[dict]:
+    return [
+        {"role": "system",
+        "content": """
+                    You are a nurse creating a comprehensive narrative for a patient's health record.
+                    Input: You will receive multiple entries summarizing the patient's health at different times.
+                    Expected Output:
+                    1. Combine all entries into a single cohesive narrative.
+                    2. Use natural language and proper formatting to ensure clarity and flow.
+                    3. Ensure details are structured in chronological order, and avoid redundancies.
+                    4. Do not assume any information that is not explicitly provided in the entries.
+                    5. Do not use any symbols like \n\n(slash n), **, etc. Just normal paragraph.
+                    6. Try to keep the structure similar to the exmaple below:
+
+                    07:00 Skilled nurse arrives at home and receives patient from outgoing nurse who stated that patient had a good day start of shift vital signs checked and documented, family and Patient covid assessment was done according to CDC guidelines, Pt and SN temp. monitored and recorded, all within normal limit, Pt head to toe assessment done, pt remains stable, lungs sounds present and clear. At 14:05, Pt had a large sized soft stool and was well cleaned, incontinent care done and new diaper worn. At 15:00 due medication AFOS 4 to 8 hrs as tolerated, Pt continue feeding, will continue monitoring. At 15:00 Pt vital signs checked and recorded, Pt continues feeding, will continue monitoring, Pt repositioned every 2hrs to prevent skin irritations and to maintain skin integrity. Trash emptied, emergency equipments at pt bedside. No new concern at this time, pt remains stable, End of shift report given to incoming nurse, Nurse off the clock.
+                    """
+        },
+        {"role": "user", "content": combined_input},
+    ]
+
+
+def incremental_narrative_messages(previous_narrative: str, new_entries: str) -> List[dict]:
+    messages = narrative_messages(f"Existing narrative:\n{previous_narrative}\n\nNew entries:\n{new_entries}")
+    messages.insert(1, {
+        "role": "system",
+        "content": "The input starts with the existing narrative for this visit, followed by new entries. "
+                   "Return the complete updated narrative: keep everything in the existing narrative and "
+                   "work the new entries into it in chronological order."
+    })
+    return messages
+
+
+def condense_messages(text: str) -> List[dict]:
+    """Prompt that shortens one chunk of an oversized input before the final summary or narrative"""
+    return [
+        {"role": "system",
+         "content": "You are condensing part of a nurse's documentation for a patient's health record. "
+                    "Rewrite the input as a concise account in chronological order. Keep every time, vital sign, "
+                    "medication, intervention and observation; drop repetition. Do not add any information "
+                    "that is not in the input. Use plain paragraph text without headings or symbols."},
+        {"role": "user", "content": text},
+    ]
+
+
+@lru_cache()
+def _encoding(model: str):
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed, estimating token counts from text length")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The encoding files are downloaded on first use; offline builds fall back to estimates
+        logger.warning(f"Tokenizer for {model} unavailable, estimating token counts: {str(e)}")
+        return None
+
+
+def warm_tokenizers(models: List[str]):
+    """Load the tokenizers of ``models`` ahead of time (blocking).
+
+    The first load may download the encoding file; done at startup in a
+    threadpool, requests never wait for it on the event loop.
+    """
+    for model in dict.fromkeys(models):
+        _encoding(model)
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return int(len(text) / _CHARS_PER_TOKEN) + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[dict], model: str) -> int:
+    """Prompt tokens of a chat request, including per-message and reply overhead"""
+    return sum(4 + count_tokens(str(message.get("content", "")), model) for message in messages) + 3
+
+
+def _shingles(text: str) -> set:
+    words = _NON_WORD.sub(" ", text.lower()).split()
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _facts(text: str) -> tuple:
+    """Numbers and negations of an entry, in order; a changed vital sign or "no" makes it a different note"""
+    lowered = text.lower().replace("\u2019", "'")
+    negations = [
+        word for word in _WORD_OR_CONTRACTION.findall(lowered)
+        if word in _NEGATIONS or word.endswith("n't")
+    ]
+    return tuple(_NUMBER.findall(lowered)), tuple(negations)
+
+
+def dedupe_entries(entries: List[str], similarity: float) -> List[str]:
+    """Drop blank, duplicate and near-duplicate entries, keeping the first of each in order.
+
+    Entries are near-duplicates when the Jaccard similarity of their word
+    trigrams is at least ``similarity`` and they have exactly the same
+    numbers and negations, e.g. the same note re-sent with different
+    punctuation, casing or spacing. "BP 120/80" and "BP 190/110", or "no
+    edema" and "edema", are always kept apart.
+    """
+    kept: List[str] = []
+    kept_keys: List[tuple] = []
+    for entry in entries:
+        if not entry.strip():
+            continue
+        shingles, facts = _shingles(entry), _facts(entry)
+        if any(
+            facts == other_facts and len(shingles & other) / len(shingles | other) >= similarity
+            for other, other_facts in kept_keys
+        ):
+            continue
+        kept.append(entry)
+        kept_keys.append((shingles, facts))
+    return kept
+
+
+def split_text(text: str, max_tokens: int, model: str) -> List[str]:
+    """Split ``text`` into pieces of at most ``max_tokens``, at sentence boundaries where possible"""
+    pieces: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for sentence in _SENTENCE_END.split(text):
+        tokens = count_tokens(sentence, model)
+        if tokens > max_tokens:
+            # A single run-on sentence: cut it by length
+            step = max(1, int(len(sentence) * max_tokens / tokens))
+            parts = [sentence[i:i + step] for i in range(0, len(sentence), step)]
+        else:
+            parts = [sentence]
+        for part in parts:
+            part_tokens = count_tokens(part, model)
+            if current and current_tokens + part_tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_entries(entries: List[str], max_tokens: int, model: str) -> List[str]:
+    """Group consecutive entries into chunks of at most ``max_tokens``; oversized entries are split"""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for entry in entries:
+        for piece in split_text(entry, max_tokens, model):
+            tokens = count_tokens(piece, model)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def truncate_text(text: str, max_tokens: int, model: str) -> str:
+    """Longest prefix of ``text`` within ``max_tokens``, cut at a sentence or word boundary where possible"""
+    encoding = _encoding(model)
+    if encoding is None:
+        cut = text[:max(0, int((max_tokens - 1) * _CHARS_PER_TOKEN))]
+    else:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    if len(cut) == len(text):
+        return text
+    # Back off to the last sentence end in the second half of the cut, else the last space
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence_end > len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    elif " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    while cut and count_tokens(cut, model) > max_tokens:
+        # Decoding can merge tokens differently than the original text
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut.rstrip()
+
+
+class FittedInput:
+    """Input text that fits the token budget, with how it was obtained"""
+
+    def __init__(self, text: str, tokens: int, entries: int, kept: int, rounds: int, truncated: int = 0):
+        self.text = text
+        self.tokens = tokens
+        self.entries = entries
+        self.kept = kept
+        self.rounds = rounds
+        self.truncated = truncated
+
+    def describe(self) -> str:
+        condensed = f", condensed in {self.rounds} round(s)" if self.rounds else ""
+        truncated = f", truncated by {self.truncated} tokens" if self.truncated else ""
+        return f"{self.kept} of {self.entries} entries, {self.tokens} input tokens{condensed}{truncated}"
+
+
+async def fit_to_budget(
+    entries: List[str],
+    model: str,
+    condense: Callable[[List[dict]], Awaitable[Optional[str]]],
+    budget: Optional[int] = None,
+) -> FittedInput:
+    """Deduplicate ``entries`` and shrink them to at most ``budget`` tokens.
+
+    Input over the budget is summarized hierarchically: it is cut into
+    PROMPT_CHUNK_TOKENS chunks, each chunk is condensed with ``condense``
+    (concurrently), and the condensed chunks are combined, repeating until
+    the result fits. Whatever is still over the budget after
+    PROMPT_MAX_CONDENSE_ROUNDS is truncated, so the result never exceeds it.
+    """
+    budget = budget if budget is not None else settings.PROMPT_INPUT_TOKEN_BUDGET
+    kept = dedupe_entries(entries, settings.PROMPT_DEDUP_SIMILARITY)
+    parts = kept
+    text = "\n\n".join(parts)
+    tokens = count_tokens(text, model)
+    rounds = 0
+
+    while tokens > budget and rounds < settings.PROMPT_MAX_CONDENSE_ROUNDS:
+        rounds += 1
+        chunks = chunk_entries(parts, settings.PROMPT_CHUNK_TOKENS, model)
+        logger.info(f"Input of {tokens} tokens is over the {budget} token budget, condensing {len(chunks)} chunks")
+        condensed = await asyncio.gather(*(condense(condense_messages(chunk)) for chunk in chunks))
+        parts = [part for part in condensed if part]
+        text = "\n\n".join(parts)
+        tokens = count_tokens(text, model)
+
+    truncated = 0
+    if tokens > budget:
+        text = truncate_text(text, budget, model)
+        truncated = tokens - count_tokens(text, model)
+        logger.warning(
+            f"Input still {tokens - budget} tokens over the {budget} token budget after {rounds} condense round(s), "
+            f"truncating it to {tokens - truncated} tokens"
+        )
+        tokens -= truncated
+
+    return FittedInput(text, tokens, len(entries), len(kept), rounds, truncated)
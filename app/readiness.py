@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+
+from .config import get_settings
+from .database import ping_database
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class Readiness:
+    """Runs startup work in the background and answers readiness checks.
+
+    Startup (migrations, seeding, background workers) is retried with
+    exponential backoff until it succeeds, so a worker that boots while
+    the database is unreachable stays up and reports not ready instead of
+    crashing. Ready means startup finished and the database answers now.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, initialize: Callable[[], Awaitable[None]]):
+        self._task = asyncio.create_task(self._initialize(initialize))
+
+    async def stop(self):
+        self.started = False
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _initialize(self, initialize: Callable[[], Awaitable[None]]):
+        delay = 1.0
+        while True:
+            try:
+                await initialize()
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Startup failed, retrying in {delay:.0f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.STARTUP_RETRY_MAX_DELAY)
+                continue
+            self.started = True
+            self.error = None
+            logger.info("Application is ready")
+            return
+
+    async def check(self) -> Tuple[bool, Dict[str, str]]:
+        """(ready, per-check status)"""
+        checks: Dict[str, str] = {}
+        if self.started:
+            checks["startup"] = "ok"
+        else:
+            checks["startup"] = f"pending: {self.error}" if self.error else "pending"
+
+        try:
+            await asyncio.wait_for(run_in_threadpool(ping_database), settings.READINESS_DB_TIMEOUT)
+            checks["database"] = "ok"
+        except asyncio.TimeoutError:
+            checks["database"] = "timeout"
+        except HTTPException as e:
+            checks["database"] = f"unavailable: {e.detail}"
+        except Error as e:
+            checks["database"] = f"unavailable: {str(e)}"
+
+        return all(value == "ok" for value in checks.values()), checks
+
+
+readiness = Readiness()
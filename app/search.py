@@ -0,0 +1,111 @@
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+
+from .config import get_settings
+from .database import search_records
+from .history import AUDIO_TABLE, NARRATIVE_TABLE, decode_cursor, encode_cursor
+from .metrics import track_stage
+from .models import RecordPage
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# kind -> (table, returned columns, FULLTEXT index columns from migration 5)
+SEARCH_TABLES = {
+    "transcripts": (
+        AUDIO_TABLE,
+        ["id", "process_id", "chat_id", "user_id", "status", "created_at"],
+        ["audio_text", "text_summary"],
+    ),
+    "narratives": (
+        NARRATIVE_TABLE,
+        ["id", "visit_id", "chat_id", "user_id", "status", "created_at"],
+        ["narrative"],
+    ),
+}
+
+_WORD = re.compile(r"\w+")
+
+
+def snippet_anchor(query: str) -> str:
+    """Longest word of the query; snippets are cut around its first occurrence"""
+    words = _WORD.findall(query)
+    if not words:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Search query has no words")
+    return max(words, key=len)
+
+
+def clean_snippet(text: Optional[str], start: Optional[int]) -> Optional[str]:
+    """Trim partial words at the cut edges, mark them with an ellipsis and collapse whitespace"""
+    if not text:
+        return None
+    head = start is not None and start > 1
+    tail = len(text) >= settings.SEARCH_SNIPPET_CHARS
+    if head and " " in text:
+        text = text[text.index(" ") + 1:]
+    if tail and " " in text:
+        text = text[:text.rindex(" ")]
+    text = " ".join(text.split())
+    return ("…" if head else "") + text + ("…" if tail else "")
+
+
+async def search(
+    kind: str,
+    query: str,
+    user_id: Optional[str],
+    chat_id: Optional[str],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+    cursor: Optional[str],
+    limit: int,
+) -> RecordPage:
+    """Relevance-ranked FULLTEXT search with snippets instead of whole TEXT columns.
+
+    Results are paged by offset, since rows are ordered by score; the
+    cursor stops at SEARCH_MAX_RESULTS so deep pages cannot scan the
+    whole match set.
+    """
+    if kind not in SEARCH_TABLES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown search '{kind}'. Available: {', '.join(SEARCH_TABLES)}"
+        )
+    table, columns, match_columns = SEARCH_TABLES[kind]
+    anchor = snippet_anchor(query)
+    filters = {column: value for column, value in (("user_id", user_id), ("chat_id", chat_id)) if value}
+    offset = decode_cursor(cursor) or 0
+    limit = max(1, min(limit, settings.SEARCH_MAX_PAGE_SIZE, settings.SEARCH_MAX_RESULTS - offset))
+    if offset >= settings.SEARCH_MAX_RESULTS:
+        return RecordPage(items=[])
+
+    try:
+        with track_stage("search", table):
+            rows = await run_in_threadpool(
+                search_records, table, columns, match_columns, query, anchor,
+                settings.SEARCH_SNIPPET_CHARS // 3, settings.SEARCH_SNIPPET_CHARS,
+                filters, created_from, created_to, limit + 1, offset
+            )
+    except Error as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error")
+
+    items: List[dict] = []
+    for row in rows[:limit]:
+        item = {column: row[column] for column in columns}
+        item["score"] = round(float(row["score"]), 4)
+        item["snippets"] = {
+            column: clean_snippet(row[f"{column}_snippet"], row[f"{column}_start"])
+            for column in match_columns
+        }
+        items.append(item)
+
+    next_offset = offset + limit
+    next_cursor = encode_cursor(next_offset) if len(rows) > limit and next_offset < settings.SEARCH_MAX_RESULTS else None
+    return RecordPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,130 @@
+import json
+import logging
+from typing import AsyncIterator, List, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from .models import AudioProcessingInput, NarrativeInput
+from .pipeline import (
+    NARRATIVE_MODEL,
+    SUMMARY_MODEL,
+    build_audio_output,
+    build_narrative_output,
+    plan_narrative,
+    save_audio_output,
+    save_narrative_output,
+    stream_completion,
+    summary_prompt,
+    transcribe_audio
+)
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Stop nginx from buffering the event stream
+}
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format one server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def _forward(deltas: AsyncIterator[str], parts: List[str]) -> AsyncIterator[str]:
+    async for delta in deltas:
+        parts.append(delta)
+        yield sse_event({"delta": delta})
+
+
+async def stream_narrative(input: NarrativeInput, incremental: bool = False) -> StreamingResponse:
+    """Stream the combined narrative as SSE ``delta`` events.
+
+    The assembled narrative is stored in narrative_records once the model
+    finishes and sent as a final ``done`` event with the NarrativeOutput.
+    When incremental mode finds nothing new, the stored narrative is sent
+    as a single delta.
+    """
+    plan = await plan_narrative(input, incremental)
+    if plan.messages is None:
+        output = build_narrative_output(input, plan.narrative)
+
+        async def stored():
+            yield sse_event({"delta": output.narrative})
+            yield sse_event(output.model_dump(), event="done")
+
+        return StreamingResponse(stored(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    try:
+        deltas = await stream_completion(NARRATIVE_MODEL, plan.messages, "narrative", "generation")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.error("Error generating narrative", exc_info=True)
+        raise HTTPException(status_code=500, detail="Narrative generation failed")
+
+    async def events():
+        parts: List[str] = []
+        try:
+            async for event in _forward(deltas, parts):
+                yield event
+            output = build_narrative_output(input, "".join(parts))
+            await save_narrative_output(output, plan.entry_hashes)
+            logger.info(f"Narrative stream completed successfully for visit_id: {input.visit_id}")
+            yield sse_event(output.model_dump(), event="done")
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+        except Exception as e:
+            logger.error(f"Error streaming narrative: {str(e)}", exc_info=True)
+            yield sse_event({"detail": "Narrative generation failed"}, event="error")
+        finally:
+            await deltas.aclose()
+
+    # The background close covers a response whose body never started; closing twice is harmless
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS, background=BackgroundTask(deltas.aclose)
+    )
+
+
+async def stream_audio_summary(input: AudioProcessingInput) -> StreamingResponse:
+    """Transcribe the audio, then stream its summary as SSE ``delta`` events.
+
+    Download and transcription happen before the response starts, so their
+    failures are still returned as regular HTTP errors. A ``transcript``
+    event precedes the summary deltas and a ``done`` event carries the
+    stored AudioProcessingOutput.
+    """
+    transcript_text, audio_link = await transcribe_audio(input)
+    try:
+        messages = await summary_prompt(transcript_text)
+        deltas = await stream_completion(SUMMARY_MODEL, messages, "audio", "summary")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error generating summary", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Summary generation failed: {str(e)}")
+
+    async def events():
+        parts: List[str] = []
+        try:
+            yield sse_event({"audio_text": transcript_text}, event="transcript")
+            async for event in _forward(deltas, parts):
+                yield event
+            output = build_audio_output(input, audio_link, transcript_text, "".join(parts))
+            await save_audio_output(input, output)
+            yield sse_event(output.model_dump(), event="done")
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+        except Exception as e:
+            logger.error(f"Error streaming summary: {str(e)}", exc_info=True)
+            yield sse_event({"detail": "Summary generation failed"}, event="error")
+        finally:
+            await deltas.aclose()
+
+    # The background close covers a response whose body never started; closing twice is harmless
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS, background=BackgroundTask(deltas.aclose)
+    )
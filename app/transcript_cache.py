@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+
+from .config import get_settings
+from .database import get_cached_transcript, save_cached_transcript
+from .metrics import TRANSCRIPT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class TranscriptCache:
+    """Transcripts keyed by audio content hash.
+
+    An in-process LRU sits in front of the ``transcription_cache`` table, so
+    repeat uploads of the same audio skip Whisper entirely. Database errors
+    are logged and treated as misses; the cache never fails a request.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: Tuple[str, str], text: str):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, audio_sha256: str, model: str) -> Optional[str]:
+        key = (audio_sha256, model)
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+
+        if text is None:
+            try:
+                text = await run_in_threadpool(get_cached_transcript, audio_sha256, model)
+            except (Error, HTTPException) as e:
+                logger.warning(f"Transcript cache lookup failed: {str(e)}")
+                text = None
+            if text is not None and not text.strip():
+                # Stored before empty transcripts stopped being cached; transcribe again
+                text = None
+            if text is not None:
+                self._remember(key, text)
+
+        if text is None:
+            self.misses += 1
+            TRANSCRIPT_CACHE_REQUESTS.labels("miss").inc()
+            logger.info(f"Transcript cache miss for {audio_sha256[:12]} (hits={self.hits}, misses={self.misses})")
+        else:
+            self.hits += 1
+            TRANSCRIPT_CACHE_REQUESTS.labels("hit").inc()
+            logger.info(f"Transcript cache hit for {audio_sha256[:12]} (hits={self.hits}, misses={self.misses})")
+        return text
+
+    async def put(self, audio_sha256: str, model: str, text: str):
+        self._remember((audio_sha256, model), text)
+        try:
+            await run_in_threadpool(save_cached_transcript, audio_sha256, model, text)
+        except (Error, HTTPException) as e:
+            logger.warning(f"Failed to store transcript in cache: {str(e)}")
+
+
+transcript_cache = TranscriptCache(settings.TRANSCRIPT_CACHE_SIZE)
+
+
+_file_hashes: Dict[Tuple[str, float, int], str] = {}
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a local file, memoized by path, mtime and size (blocking)"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
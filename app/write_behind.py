@@ -0,0 +1,282 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from mysql.connector import Error
+
+from .config import get_settings
+from .database import insert_audio_processing_records, insert_narrative_records, insert_processing_records
+from .metrics import WRITE_BEHIND_PENDING, track_stage
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+AUDIO = "audio"
+NARRATIVE = "narrative"
+
+_DIRECT_INSERTS = {
+    AUDIO: insert_audio_processing_records,
+    NARRATIVE: insert_narrative_records,
+}
+
+Entry = Tuple[str, tuple]
+
+
+def _encode_value(value):
+    # processed_at; MySQL reads the string back into the DATETIME column
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class WriteBehindBuffer:
+    """Buffers processing records and writes them with ``executemany`` in the background.
+
+    Every row is appended and fsynced to a per-worker spill file before
+    ``add`` returns, and the spill file is rewritten to the still-pending
+    rows after each successful flush. A flush happens every
+    ``flush_interval`` seconds, as soon as ``batch_size`` rows are waiting,
+    and on shutdown; rows left in spill files by a crashed worker are loaded
+    on the next startup. Delivery is at-least-once: a crash between a commit
+    and the spill rewrite stores those rows twice.
+    """
+
+    def __init__(self, spill_dir: str, batch_size: int, flush_interval: float):
+        self.spill_dir = Path(spill_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Entry] = []
+        # Taken by a flush but not committed yet
+        self._flushing: List[Entry] = []
+        self._lock = threading.Lock()
+        self._spill: Optional[IO[str]] = None
+        self._spill_path: Optional[Path] = None
+        self._slot_lock: Optional[IO[str]] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self.running:
+            return
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        recovered = await run_in_threadpool(self._open_spill)
+        if recovered:
+            logger.info(f"Recovered {recovered} unwritten processing records from spill files")
+            self._full.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write everything still buffered"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        await self.flush()
+        if self._pending:
+            logger.warning(f"{len(self._pending)} processing records left in {self._spill_path} for the next startup")
+        await run_in_threadpool(self._close_spill)
+
+    async def add(self, table: str, records: List[tuple]):
+        """Buffer rows for ``table``; they are durable in the spill file once this returns"""
+        await run_in_threadpool(self._append, [(table, record) for record in records])
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def latest_narrative(self, visit_id: str, user_id: str) -> Optional[dict]:
+        """Newest buffered successful narrative for a visit, shaped like get_latest_narrative.
+
+        Covers rows still pending or in a flush that has not committed, but
+        only for this worker; other workers' buffers are not visible.
+        """
+        with self._lock:
+            entries = self._flushing + self._pending
+        for table, record in reversed(entries):
+            if table == NARRATIVE and record[0] == visit_id and record[2] == user_id and record[4] == "success":
+                return {"narrative": record[3], "entry_hashes": record[5]}
+        return None
+
+    async def flush(self) -> int:
+        """Write buffered rows in batches of ``batch_size``; returns the number written"""
+        written = 0
+        async with self._flush_lock:
+            while True:
+                entries = await run_in_threadpool(self._take)
+                if not entries:
+                    break
+                audio = [record for table, record in entries if table == AUDIO]
+                narrative = [record for table, record in entries if table == NARRATIVE]
+                try:
+                    with track_stage("write_behind", "flush"):
+                        await run_in_threadpool(insert_processing_records, audio, narrative)
+                except (Error, HTTPException) as e:
+                    await run_in_threadpool(self._restore, entries)
+                    logger.error(f"Write-behind flush of {len(entries)} rows failed, retrying later: {str(e)}")
+                    break
+                await run_in_threadpool(self._compact)
+                written += len(entries)
+                logger.info(f"Write-behind flushed {len(audio)} audio and {len(narrative)} narrative records")
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.error("Write-behind flush loop error", exc_info=True)
+
+    # Spill file handling; everything below blocks and runs in a threadpool
+
+    def _open_spill(self) -> int:
+        """Claim a spill slot for this worker and load rows left by earlier processes"""
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for n in count():
+            lock = open(self.spill_dir / f"write_behind-{n}.lock", "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+            self._slot_lock = lock
+            self._spill_path = self.spill_dir / f"write_behind-{n}.jsonl"
+            break
+
+        recovered = self._read_spill(self._spill_path)
+        orphans = []
+        for lock_path in sorted(self.spill_dir.glob("write_behind-*.lock")):
+            spill_path = lock_path.with_suffix(".jsonl")
+            if spill_path == self._spill_path or not spill_path.exists():
+                continue
+            # A slot nobody holds belongs to a worker that is gone
+            with open(lock_path, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                recovered.extend(self._read_spill(spill_path))
+                orphans.append(spill_path)
+
+        with self._lock:
+            self._pending = recovered
+            self._rewrite_spill()
+        for spill_path in orphans:
+            spill_path.unlink()
+        return len(recovered)
+
+    def _close_spill(self):
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            if not self._pending and self._spill_path is not None:
+                self._spill_path.unlink(missing_ok=True)
+        if self._slot_lock is not None:
+            self._slot_lock.close()
+            self._slot_lock = None
+
+    @staticmethod
+    def _read_spill(path: Path) -> List[Entry]:
+        entries: List[Entry] = []
+        if not path.exists():
+            return entries
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    entries.append((item["table"], tuple(item["row"])))
+                except (ValueError, KeyError):
+                    # A torn last line from a crash mid-append; the row was never acknowledged
+                    logger.warning(f"Skipping unreadable line in {path}")
+        return entries
+
+    @staticmethod
+    def _encode(entries: List[Entry]) -> str:
+        return "".join(
+            json.dumps({"table": table, "row": list(record)}, default=_encode_value) + "\n"
+            for table, record in entries
+        )
+
+    def _append(self, entries: List[Entry]):
+        data = self._encode(entries)
+        with self._lock:
+            self._spill.write(data)
+            self._spill.flush()
+            os.fsync(self._spill.fileno())
+            self._pending.extend(entries)
+            WRITE_BEHIND_PENDING.set(len(self._pending))
+
+    def _take(self) -> List[Entry]:
+        with self._lock:
+            entries = self._pending[:self.batch_size]
+            self._pending = self._pending[self.batch_size:]
+            self._flushing = entries
+            return entries
+
+    def _restore(self, entries: List[Entry]):
+        with self._lock:
+            self._pending = entries + self._pending
+            self._flushing = []
+
+    def _compact(self):
+        """Drop written rows from the spill file once their batch is committed"""
+        with self._lock:
+            self._flushing = []
+            self._rewrite_spill()
+
+    def _rewrite_spill(self):
+        # Caller holds self._lock; the replace is atomic so a crash keeps either file
+        tmp_path = self._spill_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self._encode(self._pending))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._spill_path)
+        if self._spill is not None:
+            self._spill.close()
+        self._spill = open(self._spill_path, "a", encoding="utf-8")
+        WRITE_BEHIND_PENDING.set(len(self._pending))
+
+
+write_behind = WriteBehindBuffer(
+    settings.WRITE_BEHIND_SPILL_DIR,
+    settings.WRITE_BEHIND_BATCH_SIZE,
+    settings.WRITE_BEHIND_FLUSH_INTERVAL,
+)
+
+
+async def persist_records(table: str, records: List[tuple]):
+    """Store processing records, through the write-behind buffer when it is running.
+
+    Raises mysql.connector.Error (or HTTPException from the pool) when
+    written directly; a spill file or encoding error falls back to a
+    direct insert.
+    """
+    if write_behind.running:
+        try:
+            await write_behind.add(table, records)
+            return
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Write-behind spill failed, inserting directly: {str(e)}")
+    await run_in_threadpool(_DIRECT_INSERTS[table], records)
@@ -0,0 +1,174 @@
+"""MySQL stand-in for benchmarks.
+
+Implements the small part of the mysql.connector connection/cursor API the
+app uses on top of a shared SQLite file, translating the MySQL dialect the
+app's queries use. ``install()`` swaps it in for ``mysql.connector.connect``
+before the app is imported; nothing in ``app/`` knows about it.
+"""
+import os
+import re
+import sqlite3
+import time
+
+import mysql.connector
+from mysql.connector import Error, errorcode
+
+_DDL_DROP_LINE = re.compile(r"^\s*(?:UNIQUE\s+|FULLTEXT\s+)?(?:INDEX|KEY)\b.*$", re.IGNORECASE | re.MULTILINE)
+_ADD_COLUMN = re.compile(r"\s*ALTER TABLE \w+ ADD COLUMN\b", re.IGNORECASE)
+_DUPLICATE_KEY = re.compile(r"ON DUPLICATE KEY UPDATE", re.IGNORECASE)
+_VALUES_FN = re.compile(r"VALUES\((\w+)\)", re.IGNORECASE)
+_MATCH = re.compile(r"MATCH\(([\w, ]+)\) AGAINST \(%s IN NATURAL LANGUAGE MODE\)", re.IGNORECASE)
+
+
+def _translate(sql: str) -> str:
+    if re.match(r"\s*CREATE TABLE", sql, re.IGNORECASE):
+        sql = _DDL_DROP_LINE.sub("", sql)
+        sql = re.sub(r",\s*\)\s*$", "\n)", sql.rstrip())
+        sql = re.sub(r"\bBIGINT PRIMARY KEY AUTO_INCREMENT\b", "INTEGER PRIMARY KEY AUTOINCREMENT", sql, flags=re.IGNORECASE)
+        sql = re.sub(r"\bON UPDATE CURRENT_TIMESTAMP\b", "", sql, flags=re.IGNORECASE)
+    sql = _MATCH.sub(lambda m: f"FT_SCORE(%s, {m.group(1)})", sql)
+    sql = re.sub(r"^\s*INSERT IGNORE", "INSERT OR IGNORE", sql, flags=re.IGNORECASE)
+    if _DUPLICATE_KEY.search(sql):
+        sql = _DUPLICATE_KEY.sub("ON CONFLICT DO UPDATE SET", sql)
+        sql = _VALUES_FN.sub(r"excluded.\1", sql)
+    return sql.replace("%s", "?")
+
+
+def _ft_score(query, *texts):
+    # Stand-in for MATCH ... AGAINST: occurrences of the query words
+    words = re.findall(r"\w+", (query or "").lower())
+    haystack = " ".join(text or "" for text in texts).lower()
+    return float(sum(haystack.count(word) for word in words))
+
+
+def _locate(needle, haystack):
+    if needle is None or haystack is None:
+        return None
+    return haystack.lower().find(needle.lower()) + 1
+
+
+def _error(e: sqlite3.Error) -> Error:
+    # The migration runner tells a missing table apart by its MySQL error number
+    errno = errorcode.ER_NO_SUCH_TABLE if "no such table" in str(e) else None
+    return Error(msg=str(e), errno=errno)
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection", dictionary: bool = False):
+        self._conn = conn
+        self._dictionary = dictionary
+        self._cursor = conn._db.cursor()
+        self.rowcount = -1
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def execute(self, sql, params=()):
+        self._conn._delay()
+        if "information_schema.COLUMNS" in sql:
+            # Column checks gate ADD COLUMN migrations, so answer them from the real table
+            table, column = params
+            columns = [row[1] for row in self._conn._db.execute(f"PRAGMA table_info({table})")]
+            self._cursor = self._conn._db.execute("SELECT ?", (int(column in columns),))
+            return
+        if "information_schema" in sql:
+            # Index introspection: report every index as present
+            self._cursor = self._conn._db.execute("SELECT 1")
+            return
+        if _ADD_COLUMN.match(sql):
+            sql = re.sub(r"\s+AFTER\s+\w+\s*$", "", sql.strip(), flags=re.IGNORECASE)
+        elif re.match(r"\s*(ALTER TABLE|CREATE (UNIQUE |FULLTEXT )?INDEX|SET SESSION)", sql, re.IGNORECASE):
+            return
+        try:
+            self._cursor.execute(_translate(sql), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise _error(e)
+        self.rowcount = self._cursor.rowcount
+
+    def executemany(self, sql, seq_params):
+        self._conn._delay()
+        try:
+            self._cursor.executemany(_translate(sql), [tuple(p) for p in seq_params])
+        except sqlite3.Error as e:
+            raise _error(e)
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeConnection:
+    """Autocommit SQLite connection; commit() and rollback() only cost a round trip"""
+
+    def __init__(self, path: str, latency: float):
+        self._latency = latency
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Named locks always succeed; SQLite serializes writers anyway
+        self._db.create_function("GET_LOCK", 2, lambda name, timeout: 1)
+        self._db.create_function("RELEASE_LOCK", 1, lambda name: 1)
+        self._db.create_function("FT_SCORE", -1, _ft_score)
+        self._db.create_function("LOCATE", 2, _locate)
+        self._db.create_function("GREATEST", -1, max)
+
+    def _delay(self):
+        # Simulated network round trip to the database server
+        if self._latency:
+            time.sleep(self._latency)
+
+    def cursor(self, dictionary=False, buffered=None, raw=None):
+        return FakeCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self._delay()
+
+    def rollback(self):
+        self._delay()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self._delay()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._db.close()
+
+
+def install(path: str, latency: float = 0.0):
+    """Route mysql.connector.connect() to SQLite at ``path`` with ``latency`` seconds per round trip"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connect(**kwargs):
+        return FakeConnection(path, latency)
+
+    mysql.connector.connect = connect
@@ -0,0 +1,118 @@
+"""Local stand-in for the OpenAI endpoints the app calls.
+
+Serves /v1/audio/transcriptions and /v1/chat/completions (plain and
+streaming) with a configurable latency and jitter, so load tests never hit
+the real API. Run with ``python -m benchmarks.fake_openai``.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY = float(os.environ.get("FAKE_OPENAI_LATENCY", "0.5"))  # Mean seconds per call
+JITTER = float(os.environ.get("FAKE_OPENAI_JITTER", "0.1"))  # +/- seconds, uniform
+STREAM_TOKENS = int(os.environ.get("FAKE_OPENAI_STREAM_TOKENS", "40"))
+
+SAMPLE_TEXT = (
+    "Patient is alert and oriented, vital signs within normal limits, blood pressure 128 over 82, "
+    "heart rate 76, lungs clear, wound dressing changed and site clean, tolerating feeding well, "
+    "repositioned every two hours, no new concerns at this time."
+)
+
+app = FastAPI(title="Fake OpenAI")
+
+
+async def _simulate_latency(scale: float = 1.0):
+    delay = max(0.0, LATENCY + random.uniform(-JITTER, JITTER)) * scale
+    await asyncio.sleep(delay)
+
+
+def _usage(prompt_text: str, completion_text: str) -> dict:
+    prompt_tokens = len(prompt_text) // 4
+    completion_tokens = len(completion_text) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    audio = await upload.read() if upload is not None else b""
+    # Bigger uploads take longer, roughly like the real API
+    await _simulate_latency(1.0 + len(audio) / (5 * 1024 * 1024))
+    # Distinct audio gets a distinct transcript, so the summary prompts differ too
+    return {"text": f"{SAMPLE_TEXT} Recording {hashlib.sha256(audio).hexdigest()[:12]}."}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4o-mini")
+    prompt_text = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await _simulate_latency()
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": SAMPLE_TEXT},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(prompt_text, SAMPLE_TEXT),
+        }
+
+    words = SAMPLE_TEXT.split(" ")
+    per_token = 1.0 / max(STREAM_TOKENS, 1)
+
+    async def events():
+        # First token arrives after a fraction of the full latency
+        await _simulate_latency(0.3)
+        for i, word in enumerate(words):
+            delta = word if i == 0 else f" {word}"
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await _simulate_latency(0.7 * per_token)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": _usage(prompt_text, SAMPLE_TEXT),
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,315 @@
+"""Offline load test for the API.
+
+Starts a fake OpenAI server, a local audio file server and the API (on the
+SQLite MySQL stand-in), then drives /token, /process_audio/ and
+/combine_narrative/ at a fixed concurrency. Every request carries a nonce
+in its audio URL and entries, so the transcript, audio store and
+completion caches miss and the full pipeline is measured; pass
+--repeat-payloads to send identical payloads and measure the cache-hit path
+instead. Reports throughput, latency
+percentiles and API process resource usage, and writes them to
+benchmarks/results/<timestamp>-<commit>.json.
+
+    python -m benchmarks.loadtest --concurrency 16 --requests 200
+    python -m benchmarks.loadtest --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import psutil
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+AUDIO_FILE = ROOT / "app" / "audio.mp3"
+
+SCENARIOS = ("token", "process_audio", "combine_narrative")
+
+NARRATIVE_ENTRIES = [
+    "07:00 Skilled nurse arrived, received patient from outgoing nurse, vital signs checked and within normal limits.",
+    "10:00 Patient tolerated feeding, repositioned to maintain skin integrity, lungs clear.",
+    "14:05 Large soft stool, incontinent care done, new diaper applied.",
+    "15:00 Medication given as scheduled, vital signs recorded, no new concerns.",
+]
+
+
+class _AudioHandler(BaseHTTPRequestHandler):
+    audio = b""
+
+    def do_GET(self):
+        # ?nonce=<x> appends it to the audio, so each nonce is a distinct recording
+        query = parse_qs(urlparse(self.path).query)
+        body = self.audio
+        if "nonce" in query:
+            body += query["nonce"][0].encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_audio_server(port: int) -> ThreadingHTTPServer:
+    _AudioHandler.audio = AUDIO_FILE.read_bytes()
+    server = ThreadingHTTPServer(("127.0.0.1", port), _AudioHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_process(args: List[str], env: Dict[str, str], workdir: str) -> subprocess.Popen:
+    # Run from a scratch directory so the API's logs/ and database stay out of the repo
+    env = {**os.environ, **env, "PYTHONPATH": str(ROOT)}
+    output = open(os.path.join(workdir, f"{args[0].rsplit('.', 1)[-1]}.out"), "wb")
+    return subprocess.Popen([sys.executable, "-m", *args], cwd=workdir, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+
+def wait_until_up(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class ResourceSampler:
+    """Samples CPU and RSS of a process tree in a background thread"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.cpu: List[float] = []
+        self.rss: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        return [self.process, *self.process.children(recursive=True)]
+
+    def _run(self):
+        for process in self._processes():
+            process.cpu_percent(None)
+        while not self._stop.wait(self.interval):
+            try:
+                processes = self._processes()
+                self.cpu.append(sum(p.cpu_percent(None) for p in processes))
+                self.rss.append(sum(p.memory_info().rss for p in processes))
+            except psutil.Error:
+                pass
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        return {
+            "cpu_percent_mean": round(sum(self.cpu) / len(self.cpu), 1) if self.cpu else None,
+            "cpu_percent_max": round(max(self.cpu), 1) if self.cpu else None,
+            "rss_mb_max": round(max(self.rss) / 1024 / 1024, 1) if self.rss else None,
+        }
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(
+    name: str, base_url: str, token: str, audio_url: str, concurrency: int, total: int, repeat_payloads: bool = False
+) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    remaining = iter(range(total))
+
+    async def one(http: httpx.AsyncClient, n: int):
+        if name == "token":
+            return await http.post("/token", data={"username": "testuser", "password": "testpass"})
+        headers = {"Authorization": f"Bearer {token}"}
+        nonce = None if repeat_payloads else uuid.uuid4().hex
+        if name == "process_audio":
+            return await http.post("/process_audio/", headers=headers, json={
+                "audio_link": f"{audio_url}?nonce={nonce}" if nonce else audio_url,
+                "chat_id": f"bench-chat-{n}", "user_id": "bench-user",
+            })
+        entries = [f"{entry} Ref {nonce}." for entry in NARRATIVE_ENTRIES] if nonce else NARRATIVE_ENTRIES
+        return await http.post("/combine_narrative/", headers=headers, json={
+            "visit_id": f"bench-visit-{n}", "chat_id": f"bench-chat-{n}", "user_id": "bench-user",
+            "entries": entries,
+        })
+
+    async def worker(http: httpx.AsyncClient):
+        for n in remaining:
+            started = time.perf_counter()
+            try:
+                response = await one(http, n)
+                key = None if response.status_code < 400 else str(response.status_code)
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if key:
+                errors[key] = errors.get(key, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 1),
+            "p95": round(percentile(ordered, 95) * 1000, 1),
+            "p99": round(percentile(ordered, 99) * 1000, 1),
+            "max": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+        },
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, previous_path: str):
+    previous = json.loads(Path(previous_path).read_text())
+    print(f"\nCompared with {previous.get('commit')} ({previous_path}):")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][metric], result["latency_ms"][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {name:18} {metric}: {old:9.1f} -> {new:9.1f} ms ({change:+.1f}%)")
+        old, new = before["throughput_rps"], result["throughput_rps"]
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {name:18} rps: {old:10.2f} -> {new:10.2f}    ({change:+.1f}%)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the API")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Mean fake OpenAI latency in seconds")
+    parser.add_argument("--openai-jitter", type=float, default=0.1, help="Uniform +/- jitter in seconds")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds per simulated DB round trip")
+    parser.add_argument("--repeat-payloads", action="store_true",
+                        help="Send identical audio and entries on every request, so all but the first hit the caches")
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    parser.add_argument("--audio-port", type=int, default=8767)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="Previous result file to compare against")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="jarvic-bench-")
+    base_url = f"http://127.0.0.1:{args.api_port}"
+    audio_url = f"http://127.0.0.1:{args.audio_port}/audio.mp3"
+
+    audio_server = start_audio_server(args.audio_port)
+    fake_openai = start_process(
+        ["benchmarks.fake_openai", "--port", str(args.openai_port)],
+        {"FAKE_OPENAI_LATENCY": str(args.openai_latency), "FAKE_OPENAI_JITTER": str(args.openai_jitter)},
+        workdir,
+    )
+    api = start_process(
+        ["benchmarks.run_app", "--port", str(args.api_port), "--workers", str(args.workers)],
+        {
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+            "DB_CONNECTION": "mysql",
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": "3306",
+            "DB_DATABASE": "bench",
+            "DB_USERNAME": "bench",
+            "DB_PASSWORD": "bench",
+            "BENCH_DB_PATH": os.path.join(workdir, "bench.sqlite3"),
+            "BENCH_DB_LATENCY": str(args.db_latency),
+            "AUDIO_STORE_DIR": os.path.join(workdir, "audio_files"),
+        },
+        workdir,
+    )
+
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.openai_port}/docs")
+        wait_until_up(f"{base_url}/ready")
+
+        token = httpx.post(f"{base_url}/token", data={"username": "testuser", "password": "testpass"}).json()["access_token"]
+
+        sampler = ResourceSampler(api.pid)
+        sampler.start()
+        results = {}
+        for name in scenarios:
+            print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}")
+            results[name] = asyncio.run(run_scenario(
+                name, base_url, token, audio_url, args.concurrency, args.requests, args.repeat_payloads
+            ))
+            latency = results[name]["latency_ms"]
+            print(f"  {results[name]['throughput_rps']} req/s, p50 {latency['p50']} ms, "
+                  f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, errors {results[name]['errors']}")
+        resources = sampler.stop()
+    finally:
+        api.terminate()
+        fake_openai.terminate()
+        api.wait(timeout=30)
+        fake_openai.wait(timeout=30)
+        audio_server.shutdown()
+
+    print(f"Server output and logs are in {workdir}")
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": results,
+        "resources": resources,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{commit}.json"
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Resources: {resources}")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Start the API against the benchmark stand-ins.
+
+Installs the SQLite-backed MySQL stand-in, then serves app.main:app with
+uvicorn. OpenAI calls go wherever OPENAI_BASE_URL points (the fake server
+when launched by benchmarks.loadtest).
+"""
+import argparse
+import os
+
+from . import fake_mysql
+
+
+def _install_stand_ins():
+    fake_mysql.install(
+        os.environ.get("BENCH_DB_PATH", "bench.sqlite3"),
+        float(os.environ.get("BENCH_DB_LATENCY", "0.002")),
+    )
+
+
+def __getattr__(name):
+    # ``benchmarks.run_app:app`` for multi-worker uvicorn: every worker
+    # process imports it and installs the stand-in before the app loads
+    if name == "app":
+        _install_stand_ins()
+        from app.main import app as api
+        return api
+    raise AttributeError(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run("benchmarks.run_app:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Settings are read once, on first import of app.config
+os.environ.update({
+    "DB_CONNECTION": "mysql",
+    "DB_HOST": "localhost",
+    "DB_PORT": "3306",
+    "DB_DATABASE": "test",
+    "DB_USERNAME": "test",
+    "DB_PASSWORD": "test",
+    "OPENAI_API_KEY": "sk-test",
+})
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Migrated SQLite stand-in for MySQL (benchmarks.fake_mysql), fresh per test"""
+    from benchmarks import fake_mysql
+    fake_mysql.install(str(tmp_path / "db.sqlite3"))
+
+    from app.database import close_pool, open_pool
+    from app.migrations import migrate
+
+    open_pool()
+    migrate()
+    yield
+    close_pool()
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from app import admission, batch
+from app.admission import AdmissionMiddleware, RouteLimiter, Shed, route_class
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(admission, "_limiters", {})
+    monkeypatch.setattr(admission.settings, "ADMISSION_CONCURRENCY", {"audio": 2, "batch": 1})
+    monkeypatch.setattr(admission.settings, "ADMISSION_QUEUE_SIZE", {"audio": 100, "batch": 0})
+    monkeypatch.setattr(admission.settings, "ADMISSION_QUEUE_TIMEOUT", 5.0)
+
+
+def test_batches_have_their_own_class():
+    assert route_class("POST", "/process_audio/batch") == "batch"
+    assert route_class("POST", "/combine_narrative/batch") == "batch"
+    assert route_class("POST", "/process_audio/") == "audio"
+
+
+def test_limiter_queues_then_sheds(monkeypatch):
+    monkeypatch.setattr(admission.settings, "ADMISSION_QUEUE_TIMEOUT", 0.05)
+
+    async def scenario():
+        limiter = RouteLimiter("audio", concurrency=1, queue_size=1)
+        await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        with pytest.raises(Shed) as full:
+            await limiter.acquire()
+        assert full.value.reason == "queue_full"
+        with pytest.raises(Shed) as timeout:
+            await waiting
+        assert timeout.value.reason == "queue_timeout"
+        assert limiter.queued == 0
+
+        # The slot freed by the first request goes to the next one
+        limiter.release(0.01)
+        await asyncio.wait_for(limiter.acquire(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_middleware_answers_503_with_retry_after_when_over_capacity():
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def call(middleware):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/process_audio/batch", "headers": []}
+        await middleware(scope, None, send)
+        return sent[0]
+
+    async def scenario():
+        middleware = AdmissionMiddleware(app)
+        first = asyncio.create_task(call(middleware))
+        await asyncio.sleep(0)
+        shed = await call(middleware)
+        release.set()
+        return (await first)["status"], shed
+
+    status, shed = asyncio.run(scenario())
+    assert status == 200
+    assert shed["status"] == 503
+    assert (b"retry-after", b"1") in shed["headers"]
+
+
+def test_batch_items_take_slots_of_their_class(monkeypatch):
+    monkeypatch.setattr(batch.settings, "BATCH_CONCURRENCY", 4)
+    running = 0
+    peak = 0
+
+    async def run_one(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item
+
+    async def scenario():
+        # Two batches of 8 items at 4 in flight each, against 2 audio slots
+        return await asyncio.gather(*(batch._fan_out(list(range(8)), run_one, "audio") for _ in range(2)))
+
+    outcomes = asyncio.run(scenario())
+    assert peak == 2
+    assert all(error is None for result in outcomes for _, _, error in result)
+
+
+def test_shed_batch_item_fails_alone(monkeypatch):
+    monkeypatch.setattr(admission.settings, "ADMISSION_QUEUE_SIZE", {"audio": 0})
+    monkeypatch.setattr(batch.settings, "BATCH_CONCURRENCY", 4)
+
+    async def run_one(item):
+        await asyncio.sleep(0.01)
+        return item
+
+    outcomes = asyncio.run(batch._fan_out(list(range(4)), run_one, "audio"))
+    errors = [error for _, _, error in outcomes]
+    assert errors.count(None) == 2
+    assert errors.count("Server is busy, try again later") == 2
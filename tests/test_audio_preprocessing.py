@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+from app import audio_preprocessing
+from app.audio_preprocessing import prepare_audio
+
+
+@pytest.mark.parametrize("stderr", [
+    # Duration not reported
+    "Output #0, mp3, to 'normalized.mp3':\n",
+    # Silence from start to end of file
+    "[silencedetect @ 0x1] silence_start: 0\nsize=      12kB time=00:00:03.00 bitrate=  32.0kbits/s\n",
+])
+def test_nothing_to_upload_falls_back_to_original(monkeypatch, stderr):
+    async def run_ffmpeg(args, stdin=None):
+        return stderr
+
+    monkeypatch.setattr(audio_preprocessing.settings, "AUDIO_PREPROCESS", True)
+    monkeypatch.setattr(audio_preprocessing, "_run_ffmpeg", run_ffmpeg)
+    assert asyncio.run(prepare_audio("audio.mp3")) is None
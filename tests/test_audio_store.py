@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+
+from app.audio_store import AudioStore
+
+AUDIO = b"ID3" + b"\x00" * 1024
+
+
+def _client(requests):
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=AUDIO, headers={"ETag": '"v1"'})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _fetch(store, requests):
+    async def fetch():
+        async with _client(requests) as client:
+            audio = await store.fetch(client, "https://example.com/a.mp3")
+        try:
+            return audio.file.read()
+        finally:
+            audio.close()
+    return asyncio.run(fetch())
+
+
+def test_object_evicted_after_commit_is_fetched_again(tmp_path):
+    store = AudioStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    assert store.usable()
+    commit = store.commit
+    evictions = []
+
+    def commit_then_evict(*args):
+        meta = commit(*args)
+        if not evictions:
+            # Another worker's eviction lands between the commit and the open
+            evictions.append(meta["sha256"])
+            (store.root / "objects" / meta["sha256"]).unlink()
+        return meta
+
+    store.commit = commit_then_evict
+    requests = []
+    assert _fetch(store, requests) == AUDIO
+    assert len(requests) == 2
+
+
+def test_object_evicted_on_every_commit_falls_back_to_a_plain_download(tmp_path):
+    store = AudioStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    assert store.usable()
+    commit = store.commit
+
+    def commit_then_evict(*args):
+        meta = commit(*args)
+        (store.root / "objects" / meta["sha256"]).unlink()
+        return meta
+
+    store.commit = commit_then_evict
+    requests = []
+    assert _fetch(store, requests) == AUDIO
+    assert len(requests) == 3
+
+
+def test_concurrent_downloads_of_one_url_all_succeed(tmp_path):
+    store = AudioStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    assert store.usable()
+    requests = []
+
+    async def fetch_all():
+        async with _client(requests) as client:
+            audios = await asyncio.gather(*(store.fetch(client, "https://example.com/a.mp3") for _ in range(16)))
+        for audio in audios:
+            audio.close()
+        return audios
+
+    audios = asyncio.run(fetch_all())
+    assert {audio.sha256 for audio in audios} == {store.lookup("https://example.com/a.mp3")["sha256"]}
+    assert list((store.root / "tmp").iterdir()) == []
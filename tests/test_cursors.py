@@ -0,0 +1,47 @@
+import asyncio
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+from app.history import decode_cursor, encode_cursor
+from app.search import search
+
+
+def _raw_cursor(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor(1234)) == 1234
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", [
+    _raw_cursor("-20"),
+    _raw_cursor("+5"),
+    _raw_cursor(" 5"),
+    _raw_cursor("1.5"),
+    _raw_cursor("abc"),
+    _raw_cursor("²"),
+    "!!!",
+    "été",
+])
+def test_malformed_or_negative_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_search_rejects_a_negative_offset_cursor_before_querying(monkeypatch):
+    from app import search as search_module
+
+    def fail(*args):
+        raise AssertionError("search_records must not run")
+
+    monkeypatch.setattr(search_module, "search_records", fail)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(search("transcripts", "fall", None, None, None, None, _raw_cursor("-20"), 10))
+    assert e.value.status_code == 400
+
@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import export
+from app.auth.models import User
+from app.export import get_export_admin
+
+
+def test_exports_are_limited_to_export_admins(monkeypatch):
+    monkeypatch.setattr(export.settings, "EXPORT_ADMINS", ["auditor"])
+
+    assert asyncio.run(get_export_admin(User(username="auditor"))).username == "auditor"
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_export_admin(User(username="nurse")))
+    assert e.value.status_code == 403
+
+
+def test_exports_are_off_without_export_admins(monkeypatch):
+    monkeypatch.setattr(export.settings, "EXPORT_ADMINS", [])
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_export_admin(User(username="auditor")))
+    assert e.value.status_code == 403
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.database import (
+    claim_job, db_connection, finish_job, get_job, insert_job, list_queued_jobs, release_jobs, renew_job_lease,
+    requeue_expired_jobs
+)
+from app.jobs import JobWorkerPool
+
+
+def _expire_lease(job_id):
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE audio_processing_jobs SET leased_until = %s WHERE job_id = %s",
+                (datetime.utcnow() - timedelta(seconds=1), job_id)
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+def test_running_job_is_requeued_only_once_its_lease_expires(database):
+    insert_job("job-1", "alice", "{}")
+    assert claim_job("job-1", "worker-a", 60) == "{}"
+
+    # A second process starting up leaves the live job alone
+    assert requeue_expired_jobs() == []
+    assert claim_job("job-1", "worker-b", 60) is None
+    assert renew_job_lease("job-1", "worker-a", 60)
+
+    _expire_lease("job-1")
+    assert requeue_expired_jobs() == ["job-1"]
+    assert claim_job("job-1", "worker-b", 60) == "{}"
+
+    # The previous owner can neither renew nor finish it any more
+    assert not renew_job_lease("job-1", "worker-a", 60)
+    assert not finish_job("job-1", "worker-a", "completed", "{}")
+    assert finish_job("job-1", "worker-b", "completed", '{"ok": true}')
+    assert get_job("job-1")["status"] == "completed"
+
+
+def test_stopping_worker_releases_its_running_jobs(database):
+    insert_job("job-1", "alice", "{}")
+    insert_job("job-2", "alice", "{}")
+    claim_job("job-1", "worker-a", 60)
+    claim_job("job-2", "worker-b", 60)
+
+    assert release_jobs("worker-a") == 1
+    assert list_queued_jobs() == ["job-1"]
+    assert get_job("job-2")["status"] == "running"
+
+
+def test_reaper_picks_up_jobs_a_stopping_worker_released(database):
+    insert_job("job-1", "alice", "{}")
+    claim_job("job-1", "worker-a", 60)
+    # worker-a drains: its running job goes back to queued, but only in the table
+    release_jobs("worker-a")
+
+    async def reap_three_times():
+        pool = JobWorkerPool(0)
+        pool.queue = asyncio.Queue()
+        await pool._reap()
+        first = pool.queue.qsize()
+        await pool._reap()
+        await pool._reap()
+        return first, [pool.queue.get_nowait() for _ in range(pool.queue.qsize())]
+
+    # Left to the process that queued it for one pass, then taken on once
+    assert asyncio.run(reap_three_times()) == (0, ["job-1"])
@@ -0,0 +1,233 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+from fastapi import HTTPException
+
+from app import openai_scheduler
+from app.openai_scheduler import AdaptiveSlots, OpenAIScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_RETRY_BASE_DELAY", 0.0)
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_RPM", {})
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_TPM", {})
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MIN_CONCURRENCY", 1)
+
+
+def _rate_limited():
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_waiter_cancelled_after_being_handed_a_slot_gives_it_back():
+    async def scenario():
+        slots = AdaptiveSlots(1)
+        assert await slots.acquire(1)
+        waiter = asyncio.create_task(slots.acquire(1))
+        await asyncio.sleep(0)
+        # The slot is handed over and the waiter cancelled before it resumes
+        slots.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert slots.in_flight == 0
+        assert await slots.acquire(0.01)
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_waiter_leaves_no_trace():
+    async def scenario():
+        slots = AdaptiveSlots(1)
+        assert await slots.acquire(1)
+        assert not await slots.acquire(0.01)
+        assert slots.in_flight == 1
+        slots.release()
+        assert slots.in_flight == 0
+        assert await slots.acquire(0.01)
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_a_503_and_frees_nothing_it_did_not_take(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_QUEUE_TIMEOUT", 0.05)
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 1})
+    scheduler = OpenAIScheduler()
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await finish.wait()
+        return "done"
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.call("m", slow))
+        await started.wait()
+        with pytest.raises(HTTPException) as e:
+            await scheduler.call("m", slow)
+        assert e.value.status_code == 503
+        assert "Retry-After" in e.value.headers
+        finish.set()
+        assert await first == "done"
+        return scheduler.limiter("m").slots.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_cancelled_call_releases_its_slot(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 1})
+    scheduler = OpenAIScheduler()
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def scenario():
+        call = asyncio.create_task(scheduler.call("m", hang))
+        await asyncio.sleep(0.01)
+        assert scheduler.limiter("m").slots.in_flight == 1
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        return scheduler.limiter("m").slots.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_timed_out_calls_release_their_slots_through_every_retry(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 1})
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MAX_RETRIES", 2)
+    scheduler = OpenAIScheduler()
+    attempts = []
+
+    async def time_out():
+        attempts.append(scheduler.limiter("m").slots.in_flight)
+        raise openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+    async def scenario():
+        with pytest.raises(openai.APITimeoutError):
+            await scheduler.call("m", time_out)
+        # With a single slot, every retry could only run if the last one gave it back
+        assert attempts == [1, 1, 1]
+        return scheduler.limiter("m").slots.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_rate_limits_halve_the_limit_and_successes_raise_it_again(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 8})
+    scheduler = OpenAIScheduler()
+    attempts = []
+
+    async def rate_limited_once():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _rate_limited()
+        return "ok"
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        limiter = scheduler.limiter("m")
+        limiter.latency = 0.0  # No cooldown between decreases
+        assert await scheduler.call("m", rate_limited_once) == "ok"
+        after_429 = limiter.slots.limit
+        for _ in range(100):
+            await scheduler.call("m", ok)
+        return after_429, limiter.slots.limit
+
+    after_429, recovered = asyncio.run(scenario())
+    # Halved by the 429, then one step up for the successful retry
+    assert 4 <= after_429 < 5
+    assert recovered == 8
+
+
+def test_limit_is_halved_once_per_cooldown_and_never_below_the_floor():
+    slots = AdaptiveSlots(8, minimum=2)
+    assert slots.decrease(cooldown=60)
+    assert not slots.decrease(cooldown=60)
+    assert slots.limit == 4
+    for _ in range(5):
+        slots.decrease(cooldown=0)
+    assert slots.limit == 2
+
+
+def test_lowered_limit_holds_back_new_callers_until_slots_drain():
+    async def scenario():
+        slots = AdaptiveSlots(4)
+        for _ in range(4):
+            assert await slots.acquire(0.01)
+        slots.decrease(cooldown=0)
+        slots.release()
+        slots.release()
+        # Two left in flight at a limit of two
+        assert not await slots.acquire(0.01)
+        slots.release()
+        assert await slots.acquire(0.01)
+
+    asyncio.run(scenario())
+
+
+class _FakeStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_abandoned_stream_frees_its_slot_and_response_on_close(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 1})
+    scheduler = OpenAIScheduler()
+    response = _FakeStream(["a", "b", "c"])
+
+    async def open_stream():
+        return response
+
+    async def scenario():
+        async with await scheduler.stream("m", open_stream) as stream:
+            assert await stream.__anext__() == "a"
+            assert scheduler.limiter("m").slots.in_flight == 1
+        return scheduler.limiter("m").slots.in_flight
+
+    assert asyncio.run(scenario()) == 0
+    assert response.closed
+
+
+def test_completion_deltas_closed_without_iterating_free_the_slot(monkeypatch):
+    from app import pipeline
+
+    monkeypatch.setattr(openai_scheduler.settings, "OPENAI_MODEL_CONCURRENCY", {"m": 1})
+    scheduler = OpenAIScheduler()
+    monkeypatch.setattr(pipeline, "openai_scheduler", scheduler)
+    response = _FakeStream([])
+
+    async def scenario():
+        deltas = await pipeline.stream_completion("m", [{"role": "user", "content": "hi"}], "narrative", "generation")
+        assert scheduler.limiter("m").slots.in_flight == 1
+        # e.g. the client disconnected before the response body started
+        await deltas.aclose()
+        await deltas.aclose()
+        return scheduler.limiter("m").slots.in_flight
+
+    async def create(**kwargs):
+        return response
+
+    monkeypatch.setattr(pipeline, "openai_client", lambda: type("Client", (), {
+        "chat": type("Chat", (), {"completions": type("Completions", (), {"create": staticmethod(create)})})
+    }))
+    assert asyncio.run(scenario()) == 0
+    assert response.closed
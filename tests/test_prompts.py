@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.prompts import _encoding, count_tokens, dedupe_entries, fit_to_budget, warm_tokenizers
+
+
+def test_input_that_condensing_cannot_shrink_is_truncated_to_the_budget():
+    async def condense(messages):
+        # A model that returns its input unchanged
+        return messages[-1]["content"]
+
+    entries = [f"At {hour:02d}:00 vitals checked and recorded, patient stable, will continue monitoring." for hour in range(24)]
+    entries = [f"{entry} Note {n}." for n in range(20) for entry in entries]
+    fitted = asyncio.run(fit_to_budget(entries, "gpt-4", condense, budget=500))
+
+    assert fitted.tokens <= 500
+    assert count_tokens(fitted.text, "gpt-4") == fitted.tokens
+    assert fitted.truncated > 0
+    assert fitted.text.startswith(entries[0])
+
+
+_NOTE = (
+    "07:00 Skilled nurse arrives at home and receives patient from outgoing nurse who stated that patient had a good day. "
+    "Start of shift vital signs checked and documented, patient and nurse temperature monitored and recorded. "
+    "Head to toe assessment done, patient remains stable, lung sounds present and clear bilaterally. "
+    "Patient repositioned every two hours to maintain skin integrity, incontinent care done and new diaper worn. "
+    "Trash emptied, emergency equipment at bedside, will continue monitoring, end of shift report given to incoming nurse. {}"
+)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("BP 120/80", "BP 190/110"),
+    ("tube feeding 60 ml", "tube feeding 20 ml"),
+    ("no edema", "edema noted"),
+])
+def test_entries_with_different_findings_are_kept(first, second):
+    assert dedupe_entries([first, second], 0.9) == [first, second]
+    # Same finding in an otherwise identical note, well above the similarity threshold
+    long_first, long_second = _NOTE.format(first), _NOTE.format(second)
+    assert dedupe_entries([long_first, long_second], 0.9) == [long_first, long_second]
+
+
+def test_resent_note_differing_in_case_spacing_and_punctuation_is_dropped():
+    note = _NOTE.format("BP 120/80, no edema.")
+    resent = "  " + note.upper().replace(", ", " ; ").replace(". ", "  ") + " "
+    assert dedupe_entries([note, resent], 0.9) == [note]
+
+
+def test_warmed_tokenizer_is_not_loaded_again_by_requests():
+    _encoding.cache_clear()
+    warm_tokenizers(["gpt-4o-mini", "gpt-4o-mini"])
+    assert _encoding.cache_info().misses == 1
+    count_tokens("BP 120/80", "gpt-4o-mini")
+    assert _encoding.cache_info().misses == 1
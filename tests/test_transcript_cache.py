@@ -0,0 +1,21 @@
+import asyncio
+
+from app import transcript_cache as transcript_cache_module
+from app.metrics import TRANSCRIPT_CACHE_REQUESTS
+from app.transcript_cache import TranscriptCache
+
+
+def _count(result):
+    return TRANSCRIPT_CACHE_REQUESTS.labels(result)._value.get()
+
+
+def test_empty_stored_transcript_is_a_miss(monkeypatch):
+    stored = {"empty": "  \n", "full": "Patient reports a fall."}
+    monkeypatch.setattr(transcript_cache_module, "get_cached_transcript", lambda sha, model: stored[sha])
+    cache = TranscriptCache(10)
+    hits, misses = _count("hit"), _count("miss")
+
+    assert asyncio.run(cache.get("empty", "whisper-1")) is None
+    assert asyncio.run(cache.get("full", "whisper-1")) == "Patient reports a fall."
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert (_count("hit") - hits, _count("miss") - misses) == (1, 1)
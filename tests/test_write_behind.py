@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+from app import pipeline, write_behind as write_behind_module
+from app.database import db_connection
+from app.models import AudioProcessingInput, AudioProcessingOutput, NarrativeInput
+from app.pipeline import audio_record, entry_hashes, plan_narrative
+from app.write_behind import AUDIO, NARRATIVE, WriteBehindBuffer
+
+
+def _audio_rows():
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT process_id, chat_id, processed_at FROM audio_processing_records")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def _record():
+    input = AudioProcessingInput(chat_id="chat-1", user_id="user-1", audio_link="https://example.com/a.mp3")
+    output = AudioProcessingOutput(
+        process_id="abc123",
+        audio_link=input.audio_link,
+        audio_text="transcript",
+        text_summary="summary",
+        processed_at="2024-01-01T00:00:00Z",
+        status="completed",
+    )
+    return audio_record(input, output)
+
+
+def test_audio_row_survives_spill_recovery_and_flush(database, tmp_path):
+    spill_dir = tmp_path / "spill"
+
+    async def crash_after_add():
+        buffer = WriteBehindBuffer(str(spill_dir), batch_size=100, flush_interval=3600)
+        await buffer.start()
+        await buffer.add(AUDIO, [_record()])
+        # Simulate a crash: drop the flush loop and the slot without flushing
+        buffer._task.cancel()
+        buffer._spill.close()
+        buffer._slot_lock.close()
+
+    async def recover_and_flush():
+        buffer = WriteBehindBuffer(str(spill_dir), batch_size=100, flush_interval=3600)
+        await buffer.start()
+        written = await buffer.flush()
+        await buffer.stop()
+        return written
+
+    asyncio.run(crash_after_add())
+    assert _audio_rows() == []
+    assert len((spill_dir / "write_behind-0.jsonl").read_text().splitlines()) == 1
+
+    assert asyncio.run(recover_and_flush()) == 1
+    rows = _audio_rows()
+    assert [(row["process_id"], row["chat_id"]) for row in rows] == [("abc123", "chat-1")]
+    assert rows[0]["processed_at"]
+    assert not (spill_dir / "write_behind-0.jsonl").exists()
+
+
+def test_narrative_stays_visible_while_its_flush_commits(database, tmp_path, monkeypatch):
+    row = ("visit-1", "chat-1", "user-1", "Narrative", "success", "[]")
+    seen = []
+
+    def insert(audio, narrative):
+        seen.append(buffer.latest_narrative("visit-1", "user-1"))
+
+    async def flush():
+        await buffer.start()
+        await buffer.add(NARRATIVE, [row])
+        await buffer.flush()
+        await buffer.stop()
+
+    monkeypatch.setattr(write_behind_module, "insert_processing_records", insert)
+    buffer = WriteBehindBuffer(str(tmp_path), batch_size=100, flush_interval=3600)
+    asyncio.run(flush())
+    assert seen == [{"narrative": "Narrative", "entry_hashes": "[]"}]
+    assert buffer.latest_narrative("visit-1", "user-1") is None
+
+
+def test_incremental_narrative_rebuilds_when_stored_entries_do_not_match(monkeypatch):
+    entries = ["Patient reports a fall.", "Dressing changed on left knee."]
+    input = NarrativeInput(visit_id="visit-1", chat_id="chat-1", user_id="user-1", entries=entries)
+
+    def stored(covered):
+        previous = {"narrative": "Earlier narrative", "entry_hashes": json.dumps(entry_hashes(covered))}
+        monkeypatch.setattr(pipeline, "get_latest_narrative", lambda visit_id, user_id: previous)
+
+    # A base covering a prefix of the request is extended
+    stored(entries[:1])
+    plan = asyncio.run(plan_narrative(input, incremental=True))
+    assert "Earlier narrative" in json.dumps(plan.messages)
+
+    # A base covering an entry the request does not have is not
+    stored(entries[:1] + ["Entry edited since"])
+    plan = asyncio.run(plan_narrative(input, incremental=True))
+    assert "Earlier narrative" not in json.dumps(plan.messages)
+    assert plan.entry_hashes == entry_hashes(entries)